@@ -10,10 +10,13 @@ https://github.com/zxdavb/evohome/
 
 __version__ = '0.9.6'
 
+import asyncio
 from datetime import datetime, timedelta
 import logging
+import math
 
-import requests.exceptions
+import aiohttp
+import voluptuous as vol
 
 from homeassistant.components.climate import (
     SUPPORT_AWAY_MODE, SUPPORT_OPERATION_MODE, SUPPORT_TARGET_TEMPERATURE,
@@ -23,17 +26,23 @@ from homeassistant.components.climate import (
 from homeassistant.const import (
     CONF_SCAN_INTERVAL,
     # STATE_OFF, STATE_ON,
-    ATTR_TEMPERATURE,
+    ATTR_ENTITY_ID, ATTR_TEMPERATURE,
 )
+from homeassistant.core import callback
+import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.event import async_call_later
 from custom_components.evohome_cc import (
     STATE_AUTO, STATE_ECO, STATE_MANUAL,
 
-    DATA_EVOHOME, DISPATCHER_EVOHOME,
-    CONF_LOCATION_IDX, CONF_HIGH_PRECISION, CONF_USE_HEURISTICS,
-    CONF_USE_SCHEDULES, CONF_AWAY_TEMP, CONF_OFF_TEMP,
+    DOMAIN, DATA_EVOHOME, DISPATCHER_EVOHOME,
+    CONF_LOCATION_IDX, CONF_MAX_SCAN_INTERVAL,
+    CONF_HIGH_PRECISION, CONF_USE_HEURISTICS,
+    CONF_USE_SCHEDULES, CONF_AWAY_TEMP, CONF_OFF_TEMP, CONF_SCHEDULE_REFRESH,
+    SCHEDULE_MAX_PARALLEL, SCHEDULE_SAVE_DELAY,
 
     GWS, TCS, EVO_PARENT, EVO_CHILD, EVO_ZONE, EVO_DHW,
+    SOURCE_V1, SOURCE_V2, SOURCE_STALE,
 
     EVO_RESET, EVO_AUTO, EVO_AUTOECO, EVO_AWAY, EVO_DAYOFF, EVO_CUSTOM,
     EVO_HEATOFF, EVO_FOLLOW, EVO_TEMPOVER, EVO_PERMOVER, EVO_FROSTMODE,
@@ -41,46 +50,127 @@ from custom_components.evohome_cc import (
     TCS_STATE_TO_HA, HA_STATE_TO_TCS, TCS_OP_LIST,
     ZONE_STATE_TO_HA, HA_STATE_TO_ZONE, ZONE_OP_LIST,
 
-    EvoDevice, EvoChildDevice,
+    EvoDevice, EvoChildDevice, memoized, expected_target_temp,
+    async_fire_command_event, CMD_TIMED_OUT,
+    SystemStatus, ZoneConfig, ZoneStatus,
+    compile_schedule, find_switchpoint, save_schedules, schedule_hash,
+    format_until, local_now, requires_status,
 )
 ATTR_UNTIL = 'until'
 
+WRITE_SETTLE_DELAY = 3  # seconds, setpoint writes within this are coalesced
+
+# the controller polls more often after a write, and less often while idle
+WRITE_CONFIRM_INTERVAL = timedelta(seconds=30)  # poll this often after a write
+WRITE_CONFIRM_WINDOW = timedelta(minutes=2)  # for this long
+POLL_BACKOFF_FACTOR = 1.5  # while idle, each poll interval is longer by this
+POLL_TOLERANCE = timedelta(seconds=1)
+
+SERVICE_SET_ZONE_OVERRIDES = 'set_zone_overrides'
+SERVICE_MAX_PARALLEL = 4  # no more than the client's connection limit
+
+ATTR_OVERRIDES = 'overrides'
+ATTR_ZONE_ID = 'zone_id'
+ATTR_MODE = 'mode'
+
+ZONE_OVERRIDE_SCHEMA = vol.All(vol.Schema({
+    vol.Exclusive(ATTR_ENTITY_ID, 'zone'): cv.entity_id,
+    vol.Exclusive(ATTR_ZONE_ID, 'zone'): cv.string,
+    vol.Optional(ATTR_MODE, default=EVO_TEMPOVER):
+        vol.In([EVO_FOLLOW, EVO_TEMPOVER, EVO_PERMOVER]),
+    vol.Optional(ATTR_TEMPERATURE): vol.Coerce(float),
+    vol.Optional(ATTR_UNTIL): cv.datetime,
+}), cv.has_at_least_one_key(ATTR_ENTITY_ID, ATTR_ZONE_ID))
+
+SET_ZONE_OVERRIDES_SCHEMA = vol.Schema({
+    vol.Required(ATTR_OVERRIDES): vol.All(
+        cv.ensure_list, [ZONE_OVERRIDE_SCHEMA]),
+})
+
 _LOGGER = logging.getLogger(__name__)
 
 
 async def async_setup_platform(hass, hass_config, async_add_entities,
                                discovery_info=None):
-    """Create the Controller, and its Zones, if any."""
+    """Create the Controller(s), and their Zones, if any.
+
+    There is a Controller for each location, and each polls independently.
+    """
     evo_data = hass.data[DATA_EVOHOME]
 
     client = evo_data['client']
-    loc_idx = evo_data['params'][CONF_LOCATION_IDX]
-
-    tcs_obj_ref = client.locations[loc_idx]._gateways[0]._control_systems[0]    # noqa E501; pylint: disable=protected-access
+    controllers = []
+    zones = {}
 
-    _LOGGER.info(
-        "setup_platform(): Found Controller, id=%s (%s), name=%s "
-        "(location_idx=%s)",
-        tcs_obj_ref.systemId,
-        tcs_obj_ref.modelType,
-        tcs_obj_ref.location.name,
-        loc_idx
-    )
-
-    controller = EvoController(evo_data, client, tcs_obj_ref)
-    zones = []
+    for loc_data in evo_data['locations']:
+        tcs_config = loc_data['config'][GWS][0][TCS][0]
 
-    for zone_idx in tcs_obj_ref.zones:
-        zone_obj_ref = tcs_obj_ref.zones[zone_idx]
         _LOGGER.info(
-            "setup_platform(): Found Zone, id=%s (%s), name=%s",
-            zone_obj_ref.zoneId,
-            zone_obj_ref.zone_type,
-            zone_obj_ref.name
+            "setup_platform(): Found Controller, id=%s (%s), name=%s "
+            "(location_id=%s)",
+            tcs_config['systemId'],
+            tcs_config['modelType'],
+            loc_data['config']['locationInfo']['name'],
+            loc_data['config']['locationInfo']['locationId']
         )
-        zones.append(EvoZone(evo_data, client, zone_obj_ref))
+        controllers.append(
+            EvoController(evo_data, loc_data, client, tcs_config))
+
+        for zone_config in tcs_config['zones']:
+            _LOGGER.info(
+                "setup_platform(): Found Zone, id=%s (%s), name=%s",
+                zone_config['zoneId'],
+                zone_config['zoneType'],
+                zone_config['name']
+            )
+            zones[zone_config['zoneId']] = \
+                EvoZone(evo_data, loc_data, client, ZoneConfig(zone_config))
+
+    async_add_entities(
+        controllers + list(zones.values()), update_before_add=False)
+
+    async def async_set_zone_overrides(call):
+        """Set/cancel the overrides of many zones, in parallel.
+
+        Zones that are already in the requested state are skipped, and the
+        service returns only once all the writes have been made.
+        """
+        semaphore = asyncio.Semaphore(SERVICE_MAX_PARALLEL)
+
+        async def _async_set_override(zone, override):
+            async with semaphore:
+                await zone.async_set_override(
+                    override[ATTR_MODE],
+                    override.get(ATTR_TEMPERATURE),
+                    override.get(ATTR_UNTIL)
+                )
+
+        entities = {z.entity_id: z for z in zones.values()}
+        writes = []
 
-    async_add_entities([controller] + zones, update_before_add=False)
+        for override in call.data[ATTR_OVERRIDES]:
+            if ATTR_ZONE_ID in override:
+                zone = zones.get(override[ATTR_ZONE_ID])
+            else:
+                zone = entities.get(override[ATTR_ENTITY_ID])
+
+            if zone is None:
+                _LOGGER.error(
+                    "set_zone_overrides(): Zone not found: %s "
+                    "(skipping it).",
+                    override.get(ATTR_ZONE_ID, override.get(ATTR_ENTITY_ID))
+                )
+                continue
+
+            writes.append(_async_set_override(zone, override))
+
+        if writes:
+            await asyncio.gather(*writes)
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_SET_ZONE_OVERRIDES, async_set_zone_overrides,
+        schema=SET_ZONE_OVERRIDES_SCHEMA
+    )
 
 
 class EvoZone(EvoChildDevice, ClimateDevice):
@@ -88,14 +178,9 @@ class EvoZone(EvoChildDevice, ClimateDevice):
 
     # pylint: disable=abstract-method
 
-    def __init__(self, evo_data, client, obj_ref):
+    def __init__(self, evo_data, loc_data, client, config):
         """Initialize the evohome Zone."""
-        super().__init__(evo_data, client, obj_ref)
-
-        for _zone in evo_data['config'][GWS][0][TCS][0]['zones']:
-            if _zone['zoneId'] == self._id:
-                self._config = _zone
-                break
+        super().__init__(evo_data, loc_data, client, config)
 
         self._operation_list = ZONE_OP_LIST
         self._supported_features = \
@@ -103,6 +188,9 @@ class EvoZone(EvoChildDevice, ClimateDevice):
             SUPPORT_TARGET_TEMPERATURE | \
             SUPPORT_ON_OFF
 
+        self._queued_write = None  # (operation_mode, temperature, until)
+        self._queued_write_unsub = None
+
         _LOGGER.debug(
             "__init__(%s), self._config = %s",
             self._id + " [" + self._name + "]",
@@ -110,6 +198,7 @@ class EvoZone(EvoChildDevice, ClimateDevice):
         )
 
     @property
+    @memoized
     def state(self):
         """Return the current state of a zone - usually, its operation mode.
 
@@ -125,12 +214,11 @@ class EvoZone(EvoChildDevice, ClimateDevice):
         """
 # When Zone is 'Off' & TCS == Away: Zone = TempOver/5C
 # When Zone is 'Follow' & TCS = Away: Zone = Follow/15C
-        zone_op_mode = self._status['setpointStatus']['setpointMode']
+        zone_op_mode = self.current_operation
 
         # If possible, use inheritance to override reported state
         if zone_op_mode == EVO_FOLLOW:
-            evo_data = self.hass.data[DATA_EVOHOME]
-            tcs_op_mode = evo_data['status']['systemModeStatus']['mode']
+            tcs_op_mode = self._tcs_op_mode()
 
             if tcs_op_mode == EVO_RESET:
                 state = EVO_AUTO
@@ -143,33 +231,35 @@ class EvoZone(EvoChildDevice, ClimateDevice):
 
         # Optionally, use heuristics to override reported state (mode)
         if self._params[CONF_USE_HEURISTICS]:
-            if self._status['setpointStatus']['targetHeatTemperature'] == \
-                self.min_temp:
+            if self._status.target_temp == self.min_temp:
                 if zone_op_mode == EVO_TEMPOVER:
                     # TRV turned to Off, or ?OpenWindowMode?
                     state = EVO_FROSTMODE + " (Off?)"
                 elif zone_op_mode == EVO_PERMOVER:
                     state = EVO_FROSTMODE
 
-            if state != zone_op_mode and zone_op_mode != EVO_FOLLOW:
+            is_transition = self._is_transition('state', state)
+
+            if state != zone_op_mode and zone_op_mode != EVO_FOLLOW and \
+                    is_transition:
                 _LOGGER.warning(
                     "state(%s) = %s, via heuristics (but via api = %s)",
                     self._id,
                     state,
-                    self._status['setpointStatus']['setpointMode']
+                    self._status.setpoint_mode
                 )
             else:
                 _LOGGER.debug(
                     "state(%s) = %s, via heuristics (via api = %s)",
                     self._id,
                     state,
-                    self._status['setpointStatus']['setpointMode']
+                    self._status.setpoint_mode
                 )
         else:
             _LOGGER.debug("state(%s) = %s", self._id, state)
         return state
 
-    def _set_temperature(self, temperature, until=None):
+    async def _async_set_temperature(self, temperature, until=None):
         """Set the new target temperature of a heating zone.
 
         Turn the temperature for:
@@ -180,7 +270,7 @@ class EvoZone(EvoChildDevice, ClimateDevice):
 
         Keyword arguments can be:
           - temperature (required)
-          - until.strftime('%Y-%m-%dT%H:%M:%SZ') is:
+          - until (a datetime, sent as UTC, see: format_until()) is:
             - +1h for TemporaryOverride if not using schedules, or
             - next setpoint for TemporaryOverride if using schedules
             - none for PermanentOverride
@@ -188,7 +278,31 @@ class EvoZone(EvoChildDevice, ClimateDevice):
 # If is None: PermanentOverride - override target temp indefinitely
 #  otherwise: TemporaryOverride - override target temp, until some time
 
-        max_temp = self._config['setpointCapabilities']['maxHeatSetpoint']
+        if not self._is_valid_temperature(temperature):
+            return False
+
+        _LOGGER.warn(
+            "_set_temperature(): API call [1 request(s)]: "
+            "client.set_zone_setpoint(%s, %s, %s)...",
+            self._id,
+            temperature,
+            until
+        )
+        try:
+            await self._client.async_set_zone_setpoint(
+                self._id, temperature, until)
+
+        except aiohttp.ClientError as err:
+            self._command_failed()
+            if not self._handle_exception(err):
+                raise
+            return False
+
+        return True
+
+    def _is_valid_temperature(self, temperature):
+        """Return True if the temperature is a valid setpoint for the zone."""
+        max_temp = self._config.max_temp
         if temperature > max_temp:
             _LOGGER.error(
                 "set_temperature(%s): Temp %s is above maximum, %s! "
@@ -199,7 +313,7 @@ class EvoZone(EvoChildDevice, ClimateDevice):
             )
             return False
 
-        min_temp = self._config['setpointCapabilities']['minHeatSetpoint']
+        min_temp = self._config.min_temp
         if temperature < min_temp:
             _LOGGER.error(
                 "set_temperature(%s): Temp %s is below minimum, %s! "
@@ -210,23 +324,154 @@ class EvoZone(EvoChildDevice, ClimateDevice):
             )
             return False
 
-        _LOGGER.warn(
-            "_set_temperature(): API call [1 request(s)]: "
-            "zone(%s).set_temperature(%s, %s)...",
-            self._id,
-            temperature,
-            until
+        return True
+
+    async def _async_write(self, operation_mode, temperature, until):
+        """Write an operating mode (and setpoint) to a zone, via the api.
+
+        If the write fails, the zone's pending command (if any) is reverted.
+        """
+        if operation_mode == EVO_FOLLOW:
+            _LOGGER.warn(
+                "set_operation_mode(%s): API call [1 request(s)]: "
+                "client.cancel_zone_override()...",
+                self._id
+            )
+            try:
+                await self._client.async_cancel_zone_override(self._id)
+
+            except aiohttp.ClientError as err:
+                self._command_failed()
+                if not self._handle_exception(err):
+                    raise
+                return
+
+        elif operation_mode == EVO_PERMOVER:
+            if not await self._async_set_temperature(temperature, until=None):
+                return
+
+        else:  # operation_mode == EVO_TEMPOVER:
+            if not await self._async_set_temperature(temperature, until):
+                return
+
+        self._notify_write()
+
+    def _queue_write(self, operation_mode, temperature, until):
+        """Queue a write to a zone, coalescing it with any others queued.
+
+        Only the latest operating mode/setpoint is written, once there have
+        been no other changes for WRITE_SETTLE_DELAY seconds (e.g. a slider is
+        being dragged). Meanwhile, the zone's state is updated optimistically.
+        """
+        if operation_mode != EVO_FOLLOW and \
+                not self._is_valid_temperature(temperature):
+            return False
+
+        self._queued_write = (operation_mode, temperature, until)
+
+        if self._queued_write_unsub is not None:
+            self._queued_write_unsub()  # the earlier write is now superseded
+        self._queued_write_unsub = async_call_later(
+            self.hass, WRITE_SETTLE_DELAY, self._async_write_queued)
+
+        self._apply_write(operation_mode, temperature, until)
+        self.async_schedule_update_ha_state(force_refresh=False)
+        return True
+
+    def _apply_write(self, operation_mode, temperature, until):
+        """Update the zone's state (optimistically), as if written.
+
+        This is a pending command (overlaid onto each poll) until a poll
+        confirms (or contradicts) it, see: _issue_command().
+        """
+        _LOGGER.debug(
+            "_apply_write(%s): updating local state optimistically",
+            self._id
         )
-        try:
-            self._obj.set_temperature(temperature, until)
+        if until is not None:
+            until = format_until(until)
+
+        if operation_mode != EVO_FOLLOW:
+            self._issue_command(
+                setpoint_mode=operation_mode, target_temp=temperature,
+                until=until)
+        else:  # the target temp will be that of the schedule (if it's known)
+            setpoint = self.setpoint
+            effects = None if setpoint is None else {'target_temp': setpoint}
+            self._issue_command(
+                effects=effects, setpoint_mode=operation_mode, until=until)
+
+        self._set_state_timer()  # e.g. for the expiry of the (new) until
+
+    async def _async_write_queued(self, now=None):                              # noqa: E501; pylint: disable=unused-argument
+        """Write the queued (i.e. the latest) operating mode/setpoint."""
+        self._queued_write_unsub = None
+        operation_mode, temperature, until = self._queued_write
+        self._queued_write = None
+
+        await self._async_write(operation_mode, temperature, until)
+
+    def _is_in_state(self, operation_mode, temperature, until):
+        """Return True if the zone is already in the requested state."""
+        status = self._status
+
+        if status is None or status.setpoint_mode != operation_mode:
+            return False
+        if operation_mode == EVO_FOLLOW:
+            return True
+        if status.target_temp != temperature:
+            return False
+        if operation_mode == EVO_PERMOVER:
+            return True
+        return status.until == format_until(until)
 
-        except requests.exceptions.RequestException as err:
-            if not self._handle_exception(err):
-                raise
+    @requires_status
+    async def async_set_override(self, operation_mode, temperature=None,
+                                 until=None):
+        """Write an override to the zone now, rather than queueing it.
 
-        return None
+        Returns False (and does nothing) if the zone is already in that state.
+        """
+        if operation_mode == EVO_FOLLOW:
+            temperature = until = None
 
-    def set_temperature(self, **kwargs):
+        else:
+            if temperature is None:
+                temperature = self._status.target_temp
+
+            if operation_mode == EVO_PERMOVER:
+                until = None
+            elif until is None:
+                if self._params[CONF_USE_SCHEDULES]:
+                    until = self._next_switchpoint_time()
+                else:
+                    until = local_now() + timedelta(hours=1)
+
+            if not self._is_valid_temperature(temperature):
+                return False
+
+        if self._is_in_state(operation_mode, temperature, until):
+            _LOGGER.debug(
+                "set_override(%s): Zone is already %s (skipping it).",
+                self._id,
+                (operation_mode, temperature, until)
+            )
+            return False
+
+# This write supersedes any write that is queued for the zone
+        if self._queued_write_unsub is not None:
+            self._queued_write_unsub()
+            self._queued_write_unsub = None
+        self._queued_write = None
+
+        self._apply_write(operation_mode, temperature, until)
+        self.async_schedule_update_ha_state(force_refresh=False)
+
+        await self._async_write(operation_mode, temperature, until)
+        return True
+
+    @requires_status
+    async def async_set_temperature(self, **kwargs):
         """Set a target temperature (setpoint) for a zone.
 
         Only applies to heating zones, not DHW controllers (boilers).
@@ -258,32 +503,12 @@ class EvoZone(EvoChildDevice, ClimateDevice):
             if self._params[CONF_USE_SCHEDULES]:
                 until = self._next_switchpoint_time()
             else:
-                until = datetime.now() + timedelta(hours=1)
-
-        self._set_temperature(temperature, until)
+                until = local_now() + timedelta(hours=1)
 
-# Optionally, use heuristics to update state
-        if self._params[CONF_USE_HEURISTICS]:
-            _LOGGER.debug(
-                "set_operation_mode(): Action completed, "
-                "updating local state data using heuristics..."
-            )
-
-            self._status['setpointStatus']['setpointMode'] \
-                = EVO_PERMOVER if until is None else EVO_TEMPOVER
-
-            self._status['setpointStatus']['targetHeatTemperature'] \
-                = temperature
-
-            _LOGGER.debug(
-                "set_temperature(%s): Calling tcs.schedule_update_ha_state()",
-                self._id
-            )
-            self.async_schedule_update_ha_state(force_refresh=False)
-
-        return True
+        return self._queue_write(EVO_TEMPOVER, temperature, until)
 
-    def set_operation_mode(self, operation_mode, **kwargs):                      # noqa: E501; pylint: disable=arguments-differ
+    @requires_status
+    async def async_set_operation_mode(self, operation_mode, **kwargs):          # noqa: E501; pylint: disable=arguments-differ
         # t_operation_mode(hass, operation_mode, entity_id=None):
         """Set an operating mode for a Zone.
 
@@ -327,19 +552,7 @@ class EvoZone(EvoChildDevice, ClimateDevice):
                     operation_mode
                 )
 
-            _LOGGER.warn(
-                "set_operation_mode(%s): API call [1 request(s)]: "
-                "zone.cancel_temp_override()...",
-                self._id
-            )
-            try:
-                self._obj.cancel_temp_override(self._obj)
-
-            except requests.exceptions.RequestException as err:
-                if not self._handle_exception(err):
-                    raise
-
-        else:
+        elif operation_mode in (EVO_PERMOVER, EVO_TEMPOVER):
             if temperature is None:
                 _LOGGER.warning(
                     "set_operation_mode(%s): For '%s' mode, 'temperature' "
@@ -347,8 +560,7 @@ class EvoZone(EvoChildDevice, ClimateDevice):
                     self._id,
                     operation_mode
                 )
-                temperature = \
-                    self._status['setpointStatus']['targetHeatTemperature']
+                temperature = self._status.target_temp
 
 # PermanentOverride - override target temp indefinitely
         if operation_mode == EVO_PERMOVER:
@@ -359,8 +571,7 @@ class EvoZone(EvoChildDevice, ClimateDevice):
                     self._id,
                     operation_mode
                 )
-
-            self._set_temperature(temperature, until)
+                until = None
 
 # TemporaryOverride - override target temp, for a hour by default
         elif operation_mode == EVO_TEMPOVER:
@@ -375,36 +586,12 @@ class EvoZone(EvoChildDevice, ClimateDevice):
                 if self._params[CONF_USE_SCHEDULES]:
                     until = self._next_switchpoint_time()
                 else:
-                    until = datetime.now() + timedelta(hours=1)
+                    until = local_now() + timedelta(hours=1)
 
-            self._set_temperature(temperature, until)
-
-# Optionally, use heuristics to update state
-        if self._params[CONF_USE_HEURISTICS]:
-            _LOGGER.debug(
-                "set_operation_mode(): Action completed, "
-                "updating local state data using heuristics..."
-            )
-
-            self._status['setpointStatus']['setpointMode'] \
-                = operation_mode
-
-            if operation_mode == EVO_FOLLOW:
-                if self._params[CONF_USE_SCHEDULES]:
-                    self._status['setpointStatus']['targetHeatTemperature'] \
-                        = self.setpoint
-            else:
-                self._status['setpointStatus']['targetHeatTemperature'] = \
-                    temperature
-
-            _LOGGER.debug(
-                "Calling tcs.schedule_update_ha_state()"
-            )
-            self.async_schedule_update_ha_state(force_refresh=False)
-
-        return True
+        return self._queue_write(operation_mode, temperature, until)
 
     @property
+    @memoized
     def setpoint(self):
         """Return the current (scheduled) setpoint temperature of a zone.
 
@@ -417,11 +604,13 @@ class EvoZone(EvoChildDevice, ClimateDevice):
         """
         # Zones have: {'DhwState': 'On',     'TimeOfDay': '17:30:00'}
         # DHW has:    {'heatSetpoint': 17.3, 'TimeOfDay': '17:30:00'}
-        setpoint = self._switchpoint()['heatSetpoint']
+        _, switchpoint = self._switchpoint()
+        setpoint = switchpoint['heatSetpoint'] if switchpoint else None
         _LOGGER.debug("setpoint(%s) = %s", self._id, setpoint)
         return setpoint
 
     @property
+    @memoized
     def target_temperature(self):
         """Return the current target temperature of a zone.
 
@@ -432,53 +621,30 @@ class EvoZone(EvoChildDevice, ClimateDevice):
 # If a TRV is set to 'Off' via it's own controls, it shows up in the client api
 # as 'TemporaryOverride' (not 'PermanentOverride'!), setpoint = min, until next
 # switchpoint. If you change the controller mode, then
-        evo_data = self.hass.data[DATA_EVOHOME]
-
-        temp = self._status['setpointStatus']['targetHeatTemperature']
-
-        if self._params[CONF_USE_HEURISTICS] and \
-                self._params[CONF_USE_SCHEDULES]:
-
-            tcs_op_mode = evo_data['status']['systemModeStatus']['mode']
-            zone_op_mode = self._status['setpointStatus']['setpointMode']
-
-            if tcs_op_mode == EVO_CUSTOM:
-                pass  # target temps unknowable, must await update()
-
-            elif tcs_op_mode in (EVO_AUTO, EVO_RESET) and \
-                    zone_op_mode == EVO_FOLLOW:
-                # target temp is set according to schedule
-                temp = self.setpoint
-
-            elif tcs_op_mode == EVO_AUTOECO and \
-                    zone_op_mode == EVO_FOLLOW:
-                # target temp is relative to the scheduled setpoints, with
-                #  - setpoint => 16.5, target temp = (setpoint - 3)
-                #  - setpoint <= 16.0, target temp = (setpoint - 0)!
-                temp = self.setpoint
-                if temp > 16.0:
-                    temp = temp - 3
-
-            elif tcs_op_mode == EVO_DAYOFF and \
-                    zone_op_mode == EVO_FOLLOW:
-                # set target temp according to schedule, but for Saturday
-                this_time_saturday = datetime.now() + timedelta(
-                    days=6 - int(datetime.now().strftime('%w')))
-                temp = self._switchpoint(day_time=this_time_saturday)
-                temp = temp['heatSetpoint']
+        temp = self._status.target_temp
+
+        if self._use_local_setpoints():
+            expected = expected_target_temp(
+                self._params,
+                self._tcs_op_mode(),
+                self.current_operation,
+                self._status,
+                self._schedule['timeline'],
+                self.min_temp
+            )
+            if expected is not None:
+                temp = expected
 
-            elif tcs_op_mode == EVO_AWAY:
-                # default 'Away' temp is 15C, but can be set otherwise
-                # TBC: set to CONF_AWAY_TEMP even if set setpoint is lower
-                temp = self._params[CONF_AWAY_TEMP]
+            # a discrepancy is expected if a switchpoint has passed since the
+            # last poll, as the api's target temp won't have been updated yet
+            since, _ = self._switchpoint()
+            is_stale = since is not None and \
+                since > self._timers['statusUpdated']
 
-            elif tcs_op_mode == EVO_HEATOFF:
-                # default 'HeatingOff' temp is 5C, but can be set higher
-                # the target temp can't be less than a zone's minimum setpoint
-                temp = max(self._params[CONF_OFF_TEMP], self.min_temp)
+            is_transition = self._is_transition('target_temperature', temp)
 
-            if self.current_operation == EVO_FOLLOW and temp != \
-                self._status['setpointStatus']['targetHeatTemperature']:
+            if self._status.setpoint_mode == EVO_FOLLOW and not is_stale and \
+                    temp != self._status.target_temp and is_transition:
                 _LOGGER.warning(
                     "'targetHeatTemperature'(%s) = %s via heuristics "
                     "(via api = %s) - "
@@ -486,7 +652,7 @@ class EvoZone(EvoChildDevice, ClimateDevice):
                     "please consider submitting an issue via github",
                     self._id,
                     temp,
-                    self._status['setpointStatus']['targetHeatTemperature']
+                    self._status.target_temp
                 )
             else:
                 _LOGGER.debug(
@@ -494,8 +660,8 @@ class EvoZone(EvoChildDevice, ClimateDevice):
                     "(via api = %s)",
                     self._id,
                     temp,
-                    self._status['setpointStatus']['targetHeatTemperature']
-                    )
+                    self._status.target_temp
+                )
 
         else:
             _LOGGER.debug("target_temperature(%s) = %s", self._id, temp)
@@ -507,20 +673,21 @@ class EvoZone(EvoChildDevice, ClimateDevice):
 
         Only applies to heating zones, not DHW controllers (boilers).
         """
-        step = self._config['setpointCapabilities']['valueResolution']
+        step = self._config.temp_step
 #       step = PRECISION_HALVES
 #       _LOGGER.debug("target_temperature_step(%s) = %s", self._id, step)
         return step
 
-    def turn_off(self):
+    @requires_status
+    async def async_turn_off(self):
         """Turn device of."""
         _LOGGER.debug("turn_off(%s)", self._id)
-        self._set_temperature(self.min_temp, until=None)
+        self._queue_write(EVO_PERMOVER, self.min_temp, None)
 
-    def turn_on(self):
+    async def async_turn_on(self):
         """Turn device on."""
         _LOGGER.debug("turn_on(%s)", self._id)
-        self.set_operation_mode(EVO_FOLLOW)
+        await self.async_set_operation_mode(EVO_FOLLOW)
 
 
 class EvoController(EvoDevice, ClimateDevice):
@@ -532,19 +699,39 @@ class EvoController(EvoDevice, ClimateDevice):
 
     # pylint: disable=abstract-method
 
-    def __init__(self, evo_data, client, obj_ref):
+    def __init__(self, evo_data, loc_data, client, config):
         """Initialize the evohome Controller (hub)."""
-        super().__init__(evo_data, client, obj_ref)
+        super().__init__(evo_data, loc_data, client, config)
 
-        self._id = obj_ref.systemId
-        self._name = obj_ref.location.name
+        self._id = config['systemId']
+        self._name = loc_data['config']['locationInfo']['name']
         self._icon = "mdi:thermostat"
         self._type = EVO_PARENT
 
-        self._config = evo_data['config'][GWS][0][TCS][0]
-        self._status = evo_data['status']
+        self._location_id = loc_data['config']['locationInfo']['locationId']
+        self._status = loc_data['status']
+
+        self._child_ids = [zone['zoneId'] for zone in config['zones']]
+        if 'dhw' in config:
+            self._child_ids.append(config['dhw']['dhwId'])
         self._timers['statusUpdated'] = datetime.min
 
+        self._last_write = None
+        self._poll_interval = self._params[CONF_SCAN_INTERVAL]
+        self._max_poll_interval = max(
+            self._params.get(CONF_MAX_SCAN_INTERVAL) or self._poll_interval,
+            self._poll_interval
+        )
+        self._poll_timer_unsub = None
+
+        self._last_status_hash = None  # of the raw status (if unchanged)
+        self._last_temps_v1 = None
+        self._last_generation = None
+        self._schedules_checked = None  # when _async_update_schedules() ran
+        self._last_status_updated = False
+        self._last_system_mode = None
+        self._last_child_state = {}
+
         self._operation_list = list(TCS_STATE_TO_HA)
         # lf._config['allowedSystemModes']
         self._supported_features = \
@@ -577,7 +764,7 @@ class EvoController(EvoDevice, ClimateDevice):
         The Controller's state is usually its current operation_mode. NB: After
         calling AutoWithReset, the controller will enter Auto mode.
         """
-        if self._status['systemModeStatus']['mode'] == EVO_RESET:
+        if self.current_operation == EVO_RESET:
             state = EVO_AUTO
         else:  # usually = self.current_operation
             state = self.current_operation
@@ -588,18 +775,12 @@ class EvoController(EvoDevice, ClimateDevice):
     @property
     def is_away_mode_on(self):
         """Return true if away mode is on."""
-        away_mode = self._status['systemModeStatus']['mode'] == EVO_AWAY
+        away_mode = self.current_operation == EVO_AWAY
         _LOGGER.debug("is_away_mode_on(%s) = %s", self._id, away_mode)
         return away_mode
 
-    def async_set_operation_mode(self, operation_mode):
-        """Set new operation mode (explicitly defined as not a ClimateDevice).
-
-        This method must be run in the event loop and returns a coroutine.
-        """
-        return self.hass.async_add_job(self.set_operation_mode, operation_mode)
-
-    def set_operation_mode(self, operation_mode):
+    @requires_status
+    async def async_set_operation_mode(self, operation_mode):
         """Set new target operation mode for the TCS.
 
         'AutoWithReset may not be a mode in itself: instead, it _should_(?)
@@ -619,38 +800,41 @@ class EvoController(EvoDevice, ClimateDevice):
             "set_operation_mode(%s, operation_mode=%s), current mode = %s",
             self._id,
             operation_mode,
-            self._status['systemModeStatus']['mode']
+            self._status.mode if self._status else None
         )
 
-# PART 1: Call the api
+# PART 1: Call the api (the new mode is pending until a poll confirms it)
         if operation_mode in list(TCS_STATE_TO_HA):
+            _LOGGER.debug(
+                "set_operation_mode(%s): Changing operating mode "
+                "from '%s' to '%s' (optimistically)",
+                self._id,
+                self._status.mode,
+                operation_mode
+            )
+            # after calling AutoWithReset, the controller will enter Auto mode
+            if operation_mode == EVO_RESET:
+                self._issue_command(mode=EVO_AUTO)
+            else:
+                self._issue_command(mode=operation_mode)
+            self.async_schedule_update_ha_state(force_refresh=False)
+
             _LOGGER.warn(
                 "set_operation_mode(): API call [1 request(s)]: "
-                "tcs._set_status(%s)...",
+                "client.set_tcs_mode(%s)...",
                 operation_mode
             )
-# These 2 lines obligate only 1 location/controller, the 3rd/4th works for 1+
-# self.client._get_single_heating_system()._set_status(mode)
-# self.client.set_status_normal
-# self.client.locations[0]._gateways[0]._control_systems[0]._set_status(mode)
-# self._obj._set_status(mode)
             try:
-                self._obj._set_status(operation_mode)                            # noqa: E501; pylint: disable=protected-access
+                await self._client.async_set_tcs_mode(self._id, operation_mode)
 
-            except requests.exceptions.RequestException as err:
+            except aiohttp.ClientError as err:
+                self._command_failed()
                 if not self._handle_exception(err):
                     raise
+                self._should_poll = True
+                return
 
-            if self._params[CONF_USE_HEURISTICS]:
-                _LOGGER.debug(
-                    "set_operation_mode(%s): Using heuristics to change "
-                    "operating mode from '%s' to '%s'",
-                    self._id,
-                    self._status['systemModeStatus']['mode'],
-                    operation_mode
-                    )
-                self._status['systemModeStatus']['mode'] = operation_mode
-                self.schedule_update_ha_state(force_refresh=False)
+            self._notify_write()
         else:
             raise NotImplementedError()
 
@@ -668,27 +852,27 @@ class EvoController(EvoDevice, ClimateDevice):
                 "child's operating modes",
                 )
 
-            for zone in self._status['zones']:
+            for zone in self._status.zones:
                 if operation_mode == EVO_CUSTOM:
                     pass  # operating modes unknowable, must await update()
                 elif operation_mode == EVO_RESET:
-                    zone['setpointStatus']['setpointMode'] = EVO_FOLLOW
+                    zone.setpoint_mode = EVO_FOLLOW
                 else:
-                    if zone['setpointStatus']['setpointMode'] != EVO_PERMOVER:
-                        zone['setpointStatus']['setpointMode'] = EVO_FOLLOW
+                    if zone.setpoint_mode != EVO_PERMOVER:
+                        zone.setpoint_mode = EVO_FOLLOW
 
             # this section needs more testing
-            if 'dhw' in self._status:
-                zone = self._status['dhw']
+            if self._status.dhw is not None:
+                zone = self._status.dhw
                 if operation_mode == EVO_CUSTOM:
                     pass  # op modes unknowable, must await next update()
                 elif operation_mode == EVO_RESET:
-                    zone['stateStatus']['mode'] = EVO_FOLLOW
+                    zone.mode = EVO_FOLLOW
                 elif operation_mode == EVO_AWAY:
                     # DHW is turned off in Away mode
-                    if zone['stateStatus']['mode'] != EVO_PERMOVER:
-                        zone['stateStatus']['mode'] = EVO_FOLLOW
-#                       zone['stateStatus']['status'] = STATE_OFF
+                    if zone.mode != EVO_PERMOVER:
+                        zone.mode = EVO_FOLLOW
+#                       zone.state = STATE_OFF
                 else:
                     pass
 
@@ -704,234 +888,512 @@ class EvoController(EvoDevice, ClimateDevice):
 # At the end, the last thing to do is resume updates()
         self._should_poll = True
 
-    def async_turn_away_mode_on(self):
-        """Turn away mode on (explicitly defined as not a ClimateDevice).
-
-        This method must be run in the event loop and returns a coroutine.
-        """
-#       _LOGGER.debug("async_turn_away_mode_on(%s)", self._id)
-        return self.hass.async_add_job(self.turn_away_mode_on)
-
-    def turn_away_mode_on(self):
+    async def async_turn_away_mode_on(self):
         """Turn away mode on."""
         _LOGGER.debug("turn_away_mode_on(%s)", self._id)
-        self.set_operation_mode(EVO_AWAY)
-
-    def async_turn_away_mode_off(self):
-        """Turn away mode off  (explicitly defined as not a ClimateDevice).
-
-        This method must be run in the event loop and returns a coroutine.
-        """
-#       _LOGGER.debug("async_turn_away_mode_off(%s)", self._id)
-        return self.hass.async_add_job(self.turn_away_mode_off)
+        await self.async_set_operation_mode(EVO_AWAY)
 
-    def turn_away_mode_off(self):
+    async def async_turn_away_mode_off(self):
         """Turn away mode off."""
         _LOGGER.debug("turn_away_mode_off(%s)", self._id)
-        self.set_operation_mode(EVO_AUTO)
+        await self.async_set_operation_mode(EVO_AUTO)
+
+    async def _async_update_state_data(self, evo_data):
+        """Get the latest status of the location, and return True if unchanged.
 
-    def _update_state_data(self, evo_data):
+        The status is unchanged if its (raw) payload and the v1 temps are the
+        same as last time, and it hasn't been changed locally since (e.g. by a
+        write), in which case it isn't parsed or joined to the v1 temps.
+        """
         client = evo_data['client']
-        loc_idx = self._params[CONF_LOCATION_IDX]
+        status_updated = False
+        status_hash = None
+        temps_v1 = {}
+
+        last_hash = self._last_status_hash
+        if self._loc_data['generation'] != self._last_generation:
+            last_hash = None  # it has been changed locally, so re-parse it
 
     # 1. Obtain latest state data (e.g. temps)...
         _LOGGER.warn(
             "_update_state_data(): API call [1 request(s)]: "
-            "client.locations[loc_idx].status()..."
-        )
-
-        _LOGGER.debug(
-            "_update_state_data(): client.locations[loc_idx].locationId = %s",
-            client.locations[loc_idx].locationId
+            "client.location_status(%s)...",
+            self._location_id
         )
 
         try:
-            evo_data['status'].update(  # or: evo_data['status'] =
-                client.locations[loc_idx].status()[GWS][0][TCS][0])
+            status_hash, loc_status = await client.async_location_status(
+                self._location_id, last_hash)
 
-        except requests.exceptions.RequestException as err:
+        except aiohttp.ClientError as err:
             if not self._handle_exception(err):
                 raise
 
         else:
             # only update the timers if the api call was successful
             self._timers['statusUpdated'] = datetime.now()
+            status_updated = True
 
-        _LOGGER.debug(
-            "_update_state_data(): evo_data['status'] = %s",
-            evo_data['status']
-        )
-        _LOGGER.debug(
-            "self._timers = %s, evo_data['timers'] = %s",
-            self._timers,
-            evo_data['timers']
-            )
+            if loc_status is not None:  # else it is as it was last time
+                tcs_status = loc_status[GWS][0][TCS][0]
+                self._loc_data['status'] = SystemStatus(tcs_status)
 
-    # 2. AFTER obtaining state data, do we need to increase precision of temps?
-        if self._params[CONF_HIGH_PRECISION] and \
-                len(client.locations) > 1:
-            _LOGGER.warning(
-                "Unable to increase temperature precision via the v1 api; "
-                "there is more than one Location/TCS. Disabling this feature."
-            )
-            self._params[CONF_HIGH_PRECISION] = False
+                _LOGGER.debug(
+                    "_update_state_data(%s): status = %s",
+                    self._location_id,
+                    tcs_status
+                )
+
+        unchanged = status_updated and loc_status is None
+        _LOGGER.debug("self._timers = %s", self._timers)
 
-        elif self._params[CONF_HIGH_PRECISION]:
+    # 2. AFTER obtaining state data, do we need to increase precision of temps?
+        if self._params[CONF_HIGH_PRECISION]:
             _LOGGER.debug(
                 "Trying to increase temperature precision via the v1 api..."
             )
+            _LOGGER.warn(
+                "_update_state_data(): API call [1-2 request(s)]: "
+                "client.temperatures_v1()..."
+            )
             try:
-                from evohomeclient import EvohomeClient as EvohomeClientVer1
-                ec1_api = EvohomeClientVer1(client.username, client.password)
+                new_dict_list = await client.async_temperatures_v1(
+                    self._location_id)
 
-                _LOGGER.debug(
-                    "_update_state_data(): Calling (v1) API [2 request(s)]: "
-                    "client.temperatures()..."
-                )
-                # this is a a generator, so use list()
-                # I think: DHW first (if any), then zones ordered by name
-                new_dict_list = list(ec1_api.temperatures(force_refresh=True))
-
-#           except requests.exceptions.RequestException as err:
-#               if not self._handle_exception(err):
-#                   raise
-
-            except TypeError as err:  # v1 api doesn't use raise_for_status()
-                if not self._handle_exception(err, err_hint=ec1_api.user_data):
-                    # Or what else could it be?
-                    _LOGGER.warning(
-                        "Failed to obtain higher-precision (v1) temperatures. "
-                        "Continuing with standard (v2) temperatures for now."
-                    )
-
-                    _LOGGER.debug(
-                        "TypeError: ec1_api.user_data = %s",
-                        ec1_api.user_data
-                    )
-
-#           except:
-#               raise  # we don't handle any other exceptions
-
-            else:
                 _LOGGER.debug(
                     "_update_state_data(): new_dict_list = %s",
                     new_dict_list
                 )
+                temps_v1 = self._index_temps_v1(new_dict_list)
 
-                # start prep of the data
-                for zone in new_dict_list:
-                    del zone['name']
-                    zone['apiV1Status'] = {}
-                    # is 128 is used for 'unavailable' temps?
-                    temp = zone.pop('temp')
-                    if temp != 128:
-                        zone['apiV1Status']['temp'] = temp
-                    else:
-                        zone['apiV1Status']['temp'] = None
+            except aiohttp.ClientError as err:
+                # the v2 temps are used instead (any error has been logged)
+                if not self._handle_exception(err):
+                    raise
 
-                # first handle the DHW, if any (done this way for readability)
-                if new_dict_list[0]['thermostat'] == 'DOMESTIC_HOT_WATER':
-                    dhw_v1 = new_dict_list.pop(0)
+            except (KeyError, TypeError, ValueError) as err:
+                # the v1 API is undocumented, so its payload may be unexpected
+                _LOGGER.warning(
+                    "Failed to obtain higher-precision (v1) temperatures. "
+                    "Continuing with standard (v2) temperatures for now."
+                )
+                _LOGGER.debug("The error message is: %s", repr(err))
 
-                    dhw_v1['dhwId'] = str(dhw_v1.pop('id'))
-                    del dhw_v1['setpoint']
-                    del dhw_v1['thermostat']
+    # 3. Join the v1 temps to the v2 status, by id (without reordering it)
+        unchanged = unchanged and temps_v1 == self._last_temps_v1
+        self._last_status_hash = status_hash
+        self._last_temps_v1 = temps_v1
 
-                    dhw_v2 = evo_data['status']['dhw']
-                    dhw_v2.update(dhw_v1)  # more like a merge
+        if unchanged:
+            _LOGGER.debug(
+                "_update_state_data(%s): status is unchanged",
+                self._location_id
+            )
+        elif self._loc_data['status'] is not None:  # else there's no status
+            self._join_temps_v1(
+                self._loc_data['status'], temps_v1, status_updated)
 
-                # now, prepare the v1 zones to merge into the v2 zones
-                for zone in new_dict_list:
-                    zone['zoneId'] = str(zone.pop('id'))
-                    zone['apiV1Status']['setpoint'] = zone.pop('setpoint')
-                    del zone['thermostat']
+        return unchanged
 
-                org_dict_list = evo_data['status']['zones']
+    @staticmethod
+    def _index_temps_v1(new_dict_list):
+        """Return the (higher-precision) v1 temps, indexed by zoneId/dhwId.
 
-                _LOGGER.debug(
-                    "_update_state_data(): org_dict_list = %s",
-                    org_dict_list
-                )
+        Raises KeyError, TypeError or ValueError if the v1 payload is not as
+        expected, in which case none of the v1 temps are used.
+        """
+        temps_v1 = {}
+        for device in new_dict_list:
+            if device['temp'] == 128:  # 128 is 'unavailable'
+                continue
+            temps_v1[str(device['id'])] = {'temp': float(device['temp'])}
+            if device['thermostat'] != 'DOMESTIC_HOT_WATER':
+                temps_v1[str(device['id'])]['setpoint'] = \
+                    float(device['setpoint'])
+        return temps_v1
+
+    @staticmethod
+    def _join_temps_v1(loc_status, temps_v1, status_updated):
+        """Join the (higher-precision) v1 temps to the v2 status of a location.
+
+        This is done in place, by id, in a single pass, so that any zone
+        missing from either API is not mismatched. Each zone/DHW is given a
+        precisionSource: v1, or v2 (if there is no v1 temp), or stale (if
+        neither API has updated it, i.e. its status is from an earlier poll).
+        """
+        children = [(z.zone_id, z) for z in loc_status.zones]
+        if loc_status.dhw is not None:
+            children.append((loc_status.dhw.dhw_id, loc_status.dhw))
+
+        for child_id, child in children:
+            temp_v1 = temps_v1.get(child_id)
+
+            if temp_v1 is not None:
+                child.temp_v1 = temp_v1['temp']
+                if isinstance(child, ZoneStatus):
+                    child.setpoint_v1 = temp_v1.get('setpoint')
+                child.precision_source = SOURCE_V1
+            elif status_updated:
+                child.temp_v1 = None
+                if isinstance(child, ZoneStatus):
+                    child.setpoint_v1 = None
+                child.precision_source = SOURCE_V2
+            else:
+                child.precision_source = SOURCE_STALE
 
-                # finally, merge the v1 zones into the v2 zones
-                #  - dont use sorted(), it will create a new list!
-                new_dict_list.sort(key=lambda x: x['zoneId'])
-                org_dict_list.sort(key=lambda x: x['zoneId'])
-                # v2 and v1 lists _should_ now be zip'ble
-                for i, j in zip(org_dict_list, new_dict_list):
-                    i.update(j)
+    async def _async_update_schedule(self, evo_data, zone_id):
+        """Get the latest schedule of a Heating/DHW zone, and cache it.
 
-            finally:
-                _LOGGER.debug(
-                    "_update_state_data(): evo_data['status'] = %s",
-                    evo_data['status']
-                )
+        If this fails, any previous (e.g. cached) schedule is kept.
+        """
+        entry = evo_data['schedules'][zone_id]
+
+        _LOGGER.warn(
+            "_update_schedule(): API call [1 request(s)]: "
+            "client.schedule(%s, %s)...",
+            entry['zone_type'],
+            zone_id
+        )
+
+        try:
+            schedule = await evo_data['client'].async_schedule(
+                entry['zone_type'], zone_id)
+
+        except aiohttp.ClientError as err:
+            if not self._handle_exception(err):
+                raise
+
+        else:
+            # only update the timers if the api call was successful
+            entry['updated'] = datetime.now()
+
+            new_hash = schedule_hash(schedule)
+            if new_hash != entry['hash']:
+                entry['schedule'] = schedule
+                entry['hash'] = new_hash
+                # compile it once, rather than search it on every lookup
+                entry['timeline'] = compile_schedule(schedule)
+                self._status_changed()
+
+            _LOGGER.debug(
+                "_update_schedule(%s), schedule = %s",
+                zone_id,
+                entry['schedule']
+            )
+
+    async def _async_update_schedules(self, evo_data):
+        """Refresh the children's schedules, spread over the refresh window.
+
+        Rather than all the schedules expiring together, only the few oldest
+        are refreshed each cycle (round-robin), so that all are refreshed
+        once per window. Any child without a schedule gets one immediately.
+
+        The polls are not always evenly spaced (e.g. a poll may be skipped, or
+        forced), so each cycle's share of the window is the time since the
+        last one, and only those schedules that would otherwise be older than
+        the window by the next cycle are due.
+        """
+        now = datetime.now()
+        if self._schedules_checked is None:
+            elapsed = self._params[CONF_SCAN_INTERVAL]
+        else:
+            elapsed = now - self._schedules_checked
+        self._schedules_checked = now
+
+        children = {k: v for k, v in evo_data['schedules'].items()
+                    if v.get('zone_type') and k in self._child_ids}
+        if not children:
+            return
+
+        refresh = self._params[CONF_SCHEDULE_REFRESH]
+        per_cycle = math.ceil(len(children) * min(elapsed / refresh, 1))
+
+        missing = [k for k, v in children.items() if v['timeline'] is None]
+        oldest = sorted(
+            (k for k, v in children.items() if v['timeline'] is not None and
+             v['updated'] <= now - refresh + elapsed),
+            key=lambda k: children[k]['updated']
+        )[:per_cycle]
+
+        if not missing and not oldest:
+            return
+
+        semaphore = asyncio.Semaphore(SCHEDULE_MAX_PARALLEL)
+
+        async def _async_update(zone_id):
+            async with semaphore:
+                await self._async_update_schedule(evo_data, zone_id)
+
+        await asyncio.gather(*[_async_update(k) for k in missing + oldest])
+
+        evo_data['schedule_store'].async_delay_save(
+            lambda: save_schedules(evo_data['schedules']),
+            SCHEDULE_SAVE_DELAY
+        )
+
+    @callback
+    def _connect(self, packet):
+        """Process a dispatcher connect, including a child's write."""
+        if packet['signal'] == 'written' and packet['to'] & self._type:
+            if self._id in packet['ids']:
+                # poll sooner (and more often, for a while) to confirm it
+                self._last_write = datetime.now()
+                self._poll_interval = self._params[CONF_SCAN_INTERVAL]
+                self._set_poll_timer()
+        else:
+            super()._connect(packet)
+
+    def _next_poll(self):
+        """Return when the next poll is due.
+
+        For a while after a write, polls are frequent (if the request budget
+        allows), so that it is confirmed sooner. Otherwise, the interval
+        grows from scan_interval towards max_scan_interval while the status
+        is unchanged (see: _update_poll_interval()).
+        """
+        last_poll = self._timers['statusUpdated']
+        budget = self._client.budget
+
+        if self._last_write is not None and \
+                datetime.now() < self._last_write + WRITE_CONFIRM_WINDOW and \
+                budget.remaining > budget.reserve:
+            return max(last_poll, self._last_write) + WRITE_CONFIRM_INTERVAL
+
+        return last_poll + self._poll_interval
+
+    def _update_poll_interval(self, unchanged, status_updated):
+        """Back off the poll interval while the status is unchanged."""
+        if unchanged:
+            self._poll_interval = min(
+                self._poll_interval * POLL_BACKOFF_FACTOR,
+                self._max_poll_interval
+            )
+            _LOGGER.debug(
+                "_update_poll_interval(%s): status unchanged, interval = %s",
+                self._id,
+                self._poll_interval
+            )
+        elif status_updated:
+            self._poll_interval = self._params[CONF_SCAN_INTERVAL]
+
+    def _set_poll_timer(self):
+        """Arrange for the next poll to be made when it is due.
+
+        HA also calls update() every minute, so if the poll is overdue (e.g.
+        the last one failed), it is made then.
+        """
+        if self._poll_timer_unsub is not None:
+            self._poll_timer_unsub()
+            self._poll_timer_unsub = None
+
+        delay = (self._next_poll() - datetime.now()).total_seconds()
+        if delay > 0:
+            self._poll_timer_unsub = async_call_later(
+                self.hass, delay, self._async_poll_timer)
+
+    @callback
+    def _async_poll_timer(self, now):  # pylint: disable=unused-argument
+        """Make a poll, as it is now due."""
+        self._poll_timer_unsub = None
+        self.async_schedule_update_ha_state(force_refresh=True)
+
+    async def async_will_remove_from_hass(self):
+        """Run when entity will be removed from hass."""
+        if self._poll_timer_unsub is not None:
+            self._poll_timer_unsub()
+            self._poll_timer_unsub = None
+
+    def _changed_children(self, evo_data, status_updated):
+        """Return the ids of the children whose state has changed.
+
+        A child has changed if its status, its schedule, or its current
+        switchpoint is not as before. Returns None (i.e. all children) if the
+        status wasn't updated this time or last time (their availability may
+        have changed), or if the system mode (which they inherit) has changed.
+        """
+        status = self._loc_data['status']
+        if status is None:  # there hasn't been a successful poll, yet
+            return None
+
+        children = {z.zone_id: z for z in status.zones}
+        if status.dhw is not None:
+            children[status.dhw.dhw_id] = status.dhw
+
+        now = local_now()
+        child_state = {}
+        for child_id, child_status in children.items():
+            entry = evo_data['schedules'].get(child_id, {})
+            if entry.get('timeline') is not None:
+                switchpoint = find_switchpoint(entry['timeline'], now)[0]
+            else:
+                switchpoint = None
+            # a snapshot, as the (v1) temps are joined to the record in place
+            child_state[child_id] = \
+                (child_status.as_tuple(), entry.get('hash'), switchpoint)
+
+        system_mode = (status.mode, status.is_permanent)
+
+        if not (status_updated and self._last_status_updated) or \
+                system_mode != self._last_system_mode:
+            changed = None
+        else:
+            changed = {k for k, v in child_state.items()
+                       if self._last_child_state.get(k) != v}
+
+        self._last_status_updated = status_updated
+        self._last_system_mode = system_mode
+        self._last_child_state = child_state
+        return changed
+
+    @staticmethod
+    def _update_zone_index(loc_data):
+        """Update the index of zoneId to (the position of) each zone's status.
+
+        The zones can then find their status directly. The index is rebuilt
+        only when the zone set (or the order of the v2 status) changes.
+        """
+        zones = loc_data['status'].zones if loc_data['status'] else []
+        zone_ids = tuple(zone.zone_id for zone in zones)
+
+        if zone_ids != loc_data['zone_ids']:
+            _LOGGER.debug("_update_zone_index(): zone_ids = %s", zone_ids)
+            loc_data['zone_ids'] = zone_ids
+            loc_data['zone_idx'] = {z: i for i, z in enumerate(zone_ids)}
 
-    def update(self):
+    def _reconcile_commands(self, reparsed):
+        """Reconcile the pending commands (i.e. writes) with the latest poll.
+
+        Commands that a (newly parsed) status confirms or contradicts, or that
+        have expired, are no longer pending, and an event is fired for each.
+        The others are overlaid onto the status (the previous status already
+        has them, if it wasn't re-parsed).
+
+        Returns the ids of the devices whose overlay was reverted (in place),
+        so that they can be refreshed.
+        """
+        reverted = set()
+        pending = self._loc_data['pending']
+        status = self._loc_data['status']
+        if not pending or status is None:
+            return reverted
+
+        records = {z.zone_id: z for z in status.zones}
+        if status.dhw is not None:
+            records[status.dhw.dhw_id] = status.dhw
+        records[status.system_id] = status
+
+        now = datetime.now()
+        for device_id, command in list(pending.items()):
+            record = records.get(device_id)
+            if record is None:
+                result = CMD_TIMED_OUT if now > command.expires else None
+            elif reparsed:
+                result = command.reconcile(record, now)
+            else:  # the record has the command overlaid, so can't confirm it
+                result = CMD_TIMED_OUT if now > command.expires else None
+
+            if result is None:
+                if reparsed and record is not None:
+                    command.overlay(record)
+                continue
+
+            del pending[device_id]
+            async_fire_command_event(self.hass, command, result)
+
+            if not reparsed and record is not None:
+                # revert the overlay, and re-parse the next status in full
+                for key, value in command.previous.items():
+                    setattr(record, key, value)
+                reverted.add(device_id)
+                self._last_status_hash = None
+                self._status_changed()
+
+        return reverted
+
+    async def async_update(self):
         """Get the latest state data of the installation.
 
         This includes state data for the Controller and its child devices, such
         as the operating_mode of the Controller and the current_temperature
         of children.
-
-        This is not asyncio-friendly due to the underlying client api.
         """
         evo_data = self.hass.data[DATA_EVOHOME]
 #       self._should_poll = True
 
-        # Wait a minimum (scan_interval/60) mins (rounded up) between updates
-        timeout = datetime.now() + timedelta(seconds=55)
-        expired = timeout > self._timers['statusUpdated'] + \
-            self._params[CONF_SCAN_INTERVAL]
-
-        if not expired:  # timer not expired, so exit
-            return True
+        # the poll interval varies, see: _next_poll()
+        if datetime.now() + POLL_TOLERANCE < self._next_poll():
+            return True  # timer not expired, so exit
 
 # it is time to update state data
-# NB: unlike all other config/state data, zones maintain their own schedules
-        self._update_state_data(evo_data)
-        self._status = evo_data['status']
-
-        if _LOGGER.isEnabledFor(logging.DEBUG):
-            status = dict(self._status)  # create a copy since we're editing
-#           if 'zones' in status:
-#               status['zones'] = '...'
-#           if 'dhw' in status:
-#               status['dhw'] = '...'
+        last_updated = self._timers['statusUpdated']
+        unchanged = await self._async_update_state_data(evo_data)
+        self._update_poll_interval(
+            unchanged, self._timers['statusUpdated'] != last_updated)
+        self._set_poll_timer()
+
+        reparsed = self._loc_data['status'] is not self._status
+        if not unchanged:
+            self._status = self._loc_data['status']
+            self._update_zone_index(self._loc_data)
+        reverted = self._reconcile_commands(reparsed)
+
+        if self._params[CONF_USE_SCHEDULES]:
+            await self._async_update_schedules(evo_data)
+
+        if not unchanged:
+            self._status_changed()  # a (changed) poll has landed
+        self._last_generation = self._loc_data['generation']
+
+        if _LOGGER.isEnabledFor(logging.DEBUG) and not unchanged and \
+                self._status is not None:
+            status = self._status.as_dict()  # zones/dhw are summarised
             _LOGGER.debug(
                 "update(%s), self._status = %s",
                 self._id,
                 status
             )
 
-# Finally, send a message to the children to update themselves
-        pkt = {
-            'sender': 'controller',
-            'signal': 'refresh',
-            'to': EVO_CHILD
-        }
+# Finally, send a message to the (changed) children to update themselves
+        changed = self._changed_children(
+            evo_data, self._timers['statusUpdated'] != last_updated)
+        if changed is not None:
+            changed |= reverted
 
-        async_dispatcher_send(self.hass, DISPATCHER_EVOHOME, pkt)
+        # if re-parsed, every child is sent the packet, so as to re-bind to its
+        # (new) record, although only the changed children are refreshed
+        if changed is None or changed or reparsed:
+            _LOGGER.debug(
+                "update(%s): children to refresh = %s",
+                self._id,
+                "all" if changed is None else changed
+            )
+            pkt = {
+                'sender': 'controller',
+                'signal': 'refresh',
+                'to': EVO_CHILD,
+                'ids': changed
+            }
+
+            async_dispatcher_send(self.hass, DISPATCHER_EVOHOME, pkt)
 
         return True
 
     @property
+    @memoized
     def target_temperature(self):
         """Return the average target temperature of the Heating/DHW zones."""
-        temps = [zone['setpointStatus']['targetHeatTemperature']
-                 for zone in self._status['zones']]
+        temps = [zone.target_temp for zone in self._status.zones]
         avg_temp = round(sum(temps) / len(temps), 1) if temps else None
 
         _LOGGER.debug("target_temperature(%s) = %s", self._id, avg_temp)
         return avg_temp
 
     @property
+    @memoized
     def current_temperature(self):
         """Return the average current temperature of the Heating/DHW zones."""
-        tmp_dict = [x for x in self._status['zones']
-                    if x['temperatureStatus']['isAvailable'] is True]
-
-        temps = [zone['temperatureStatus']['temperature'] for zone in tmp_dict]
+        temps = [zone.temperature for zone in self._status.zones
+                 if zone.is_available]
         avg_temp = round(sum(temps) / len(temps), 1) if temps else None
 
         _LOGGER.debug("current_temperature(%s) = %s", self._id, avg_temp)
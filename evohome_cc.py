@@ -17,33 +17,41 @@ __version__ = '0.9.6'
 #     0-1 DHW controller, (a.k.a. Boiler)
 # The TCS & Zones are implemented as Climate devices, Boiler as a WaterHeater
 
+import asyncio
+from bisect import bisect_right
 from datetime import datetime, timedelta
+import functools
+import hashlib
+import json
 import logging
+import random
+from time import monotonic, time
 
-import requests.exceptions
+import aiohttp
 import voluptuous as vol
 
 from homeassistant.const import (
     CONF_SCAN_INTERVAL, CONF_USERNAME, CONF_PASSWORD,
-    EVENT_HOMEASSISTANT_START,
+    EVENT_HOMEASSISTANT_START, EVENT_HOMEASSISTANT_STOP,
     HTTP_BAD_REQUEST, HTTP_SERVICE_UNAVAILABLE, HTTP_TOO_MANY_REQUESTS,
+    HTTP_UNAUTHORIZED,
     PRECISION_WHOLE, PRECISION_HALVES, PRECISION_TENTHS, TEMP_CELSIUS,
     STATE_OFF, STATE_ON,
 )
 from homeassistant.core import callback
 # from homeassistant.exceptions import PlatformNotReady
 import homeassistant.helpers.config_validation as cv
-from homeassistant.helpers.discovery import load_platform
+from homeassistant.helpers.discovery import async_load_platform
 from homeassistant.helpers.dispatcher import (
     async_dispatcher_send,
     async_dispatcher_connect
 )
 from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.storage import Store
+from homeassistant.util.dt import as_utc, now as dt_now, parse_datetime, utcnow
 # from homeassistant.helpers.temperature import display_temp as show_temp
 
-# QUIREMENTS = ['https://github.com/zxdavb/evohome-client/archive/debug-version.zip#evohomeclient==0.2.8']  # noqa: E501; pylint: disable=line-too-long; ZXDEL
-REQUIREMENTS = ['evohomeclient==0.2.8']
-
 _LOGGER = logging.getLogger(__name__)
 
 # only the controller does client API I/O during update() to get current state
@@ -61,6 +69,7 @@ MAX_TEMP = 35
 CONF_LOCATION_IDX = 'location_idx'
 SCAN_INTERVAL_DEFAULT = timedelta(seconds=300)
 SCAN_INTERVAL_MINIMUM = timedelta(seconds=120)
+CONF_MAX_SCAN_INTERVAL = 'max_scan_interval'  # while the status is unchanged
 
 CONF_HIGH_PRECISION = 'high_precision'
 CONF_USE_HEURISTICS = 'use_heuristics'
@@ -68,6 +77,17 @@ CONF_USE_SCHEDULES = 'use_schedules'
 CONF_AWAY_TEMP = 'away_temp'
 CONF_OFF_TEMP = 'off_temp'
 CONF_DHW_TEMP = 'dhw_target_temp'
+CONF_SCHEDULE_REFRESH = 'schedule_refresh'
+CONF_API_HOST = 'api_host'  # e.g. a local stand-in for the vendor's servers
+CONF_ATTRIBUTE_PROFILE = 'attribute_profile'
+SCHEDULE_REFRESH_DEFAULT = timedelta(hours=1)
+SCHEDULE_REFRESH_MINIMUM = timedelta(minutes=15)
+
+# the device state attributes of the zones/DHW (which HA's recorder stores)
+ATTRS_MINIMAL = 'minimal'    # none, other than those of the climate entity
+ATTRS_STANDARD = 'standard'  # e.g. any override, faults, next switchpoint
+ATTRS_DEBUG = 'debug'        # as standard, plus the full status
+ATTRIBUTE_PROFILES = [ATTRS_MINIMAL, ATTRS_STANDARD, ATTRS_DEBUG]
 
 # Validation of the user's configuration.
 CV_FLOAT1 = vol.All(vol.Coerce(float), vol.Range(min=5, max=28))
@@ -77,10 +97,12 @@ CONFIG_SCHEMA = vol.Schema({
     DOMAIN: vol.Schema({
         vol.Required(CONF_USERNAME): cv.string,
         vol.Required(CONF_PASSWORD): cv.string,
-        vol.Optional(CONF_LOCATION_IDX, default=0):
-            cv.positive_int,
+        vol.Optional(CONF_LOCATION_IDX, default=None):
+            vol.Any(None, cv.positive_int),
         vol.Optional(CONF_SCAN_INTERVAL, default=SCAN_INTERVAL_DEFAULT):
             vol.All(cv.time_period, vol.Range(min=SCAN_INTERVAL_MINIMUM)),
+        vol.Optional(CONF_MAX_SCAN_INTERVAL):
+            vol.All(cv.time_period, vol.Range(min=SCAN_INTERVAL_MINIMUM)),
 
         vol.Optional(CONF_HIGH_PRECISION, default=True): cv.boolean,
         vol.Optional(CONF_USE_HEURISTICS, default=False): cv.boolean,
@@ -89,6 +111,11 @@ CONFIG_SCHEMA = vol.Schema({
         vol.Optional(CONF_AWAY_TEMP, default=15.0): CV_FLOAT1,
         vol.Optional(CONF_OFF_TEMP, default=5.0): CV_FLOAT1,
         vol.Optional(CONF_DHW_TEMP, default=DHW_TEMP): CV_FLOAT2,
+        vol.Optional(CONF_SCHEDULE_REFRESH, default=SCHEDULE_REFRESH_DEFAULT):
+            vol.All(cv.time_period, vol.Range(min=SCHEDULE_REFRESH_MINIMUM)),
+        vol.Optional(CONF_API_HOST): cv.url,
+        vol.Optional(CONF_ATTRIBUTE_PROFILE, default=ATTRS_STANDARD):
+            vol.In(ATTRIBUTE_PROFILES),
     }),
 }, extra=vol.ALLOW_EXTRA)
 
@@ -103,6 +130,11 @@ EVO_ZONE = 0x04
 EVO_DHW = 0x08
 EVO_UNKNOWN = 0x10
 
+# the source of a zone's current temperature (its precisionSource)
+SOURCE_V1 = 'v1'  # higher-precision, via the v1 API
+SOURCE_V2 = 'v2'  # standard precision, via the v2 API
+SOURCE_STALE = 'stale'  # not updated by either API during the last poll
+
 # HA states
 STATE_AUTO = 'auto'      # used in
 STATE_ECO = 'eco'        # used in climate, water_heater
@@ -165,15 +197,85 @@ ZONE_OP_LIST = list(HA_STATE_TO_ZONE)
 # other stuff
 DHW_STATES = {STATE_ON: 'On', STATE_OFF: 'Off'}
 
-
-def setup(hass, hass_config):
+# the vendor's web APIs: v2 is the primary API, v1 has higher-precision temps
+API_HOST = 'https://tccna.honeywell.com'
+API_AUTH_URL = '/Auth/OAuth/Token'
+API_V1_URL = '/WebAPI/api/'
+API_V2_URL = '/WebAPI/emea/api/v1/'
+
+API_V1_APP_ID = '91db1612-73fd-4500-91b2-e63b069b185c'
+API_V2_AUTH = 'Basic NGEyMzEwODktZDJiNi00MWJkLWE1ZWItMTZhMGE0MjJiOTk5OjFhMTVjZGI4LTQyZGUtNDA3Yi1hZGQwLTA1OWY5MmM1MzBjYg=='  # noqa: E501; pylint: disable=line-too-long
+API_V2_SCOPE = 'EMEA-V1-Basic EMEA-V1-Anonymous'
+
+API_KEEPALIVE_MARGIN = 30  # seconds, idle connections outlast a poll interval
+API_CONNECT_TIMEOUT = 10  # seconds (rather than aiohttp's 5 min total)
+API_READ_TIMEOUT = 30  # seconds
+
+# each class of endpoint can use only so many of the pool's connections
+API_ENDPOINT_AUTH = 'auth'
+API_ENDPOINT_STATUS = 'status'
+API_ENDPOINT_SCHEDULE = 'schedule'
+API_ENDPOINT_WRITE = 'write'
+API_ENDPOINT_LIMITS = {
+    API_ENDPOINT_AUTH: 1,
+    API_ENDPOINT_STATUS: 2,
+    API_ENDPOINT_SCHEDULE: 2,  # so schedules can't delay polls, or writes
+    API_ENDPOINT_WRITE: 2,
+}
+# the connection pool (shared by v1/v2) has room for every endpoint's share
+API_MAX_CONNECTIONS = sum(API_ENDPOINT_LIMITS.values())
+API_V1_MAX_AGE = 30  # seconds, the v1 temps (of all locations) are shared
+
+# the request budget (a token bucket) for all API I/O, and backoff on 429/503
+API_BUDGET_CAPACITY = 30  # requests, the largest burst
+API_BUDGET_RATE = 250 / 3600  # requests/second, i.e. 250 per hour
+API_BUDGET_RESERVE = 5  # requests, reads are deferred to keep these for writes
+API_BACKOFF_MINIMUM = 60  # seconds, doubled (with jitter) for every 429/503
+API_BACKOFF_MAXIMUM = 3600
+
+# the v2 schedule JSON is converted to this format (as does evohomeclient2)
+SCHEDULE_KEYS = [
+    ('dailySchedules', 'DailySchedules'),
+    ('dayOfWeek', 'DayOfWeek'),
+    ('temperature', 'TargetTemperature'),
+    ('timeOfDay', 'TimeOfDay'),
+    ('switchpoints', 'Switchpoints'),
+    ('dhwState', 'DhwState'),
+]
+DAYS_OF_WEEK = [
+    'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday',
+    'Sunday'
+]  # as per datetime.weekday()
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# schedules are cached in HA's .storage, so they survive restarts
+STORAGE_VERSION = 1
+STORAGE_KEY_SCHEDULES = DOMAIN + '.schedules'
+STORAGE_KEY_INSTALLATION = DOMAIN + '.installation'  # a (redacted) snapshot
+STORAGE_KEY_TOKENS = DOMAIN + '.tokens'  # so restarts needn't re-authenticate
+TOKEN_SAVE_DELAY = 5  # seconds
+SCHEDULE_CACHE_MAX_AGE = timedelta(days=1)  # older than this, are discarded
+SCHEDULE_SAVE_DELAY = 10  # seconds, so that writes to disk are batched
+SCHEDULE_MAX_PARALLEL = 2  # the most schedules to fetch at the same time
+STATE_TIMER_MARGIN = 1  # seconds, after a switchpoint/expiry to update state
+
+# the outcome of a write (a command), as fired in an event
+EVENT_COMMAND = DOMAIN + '_command'
+COMMAND_EXPIRY = timedelta(minutes=10)  # unconfirmed commands then time out
+CMD_CONFIRMED = 'confirmed'        # a poll agrees with it
+CMD_CONTRADICTED = 'contradicted'  # a poll has something else (e.g. via app)
+CMD_TIMED_OUT = 'timed_out'        # no poll has agreed with it, in time
+CMD_FAILED = 'failed'              # the write failed (e.g. it was deferred)
+
+
+async def async_setup(hass, hass_config):
     """Create a (EMEA/EU-based) Honeywell evohome system.
 
     Currently, only the Controller and the Zones are implemented here.
     """
     # CC; pylint: disable=too-many-branches, too-many-statements
     evo_data = hass.data[DATA_EVOHOME] = {}
-    evo_data['timers'] = {}
 
     # use a copy, since scan_interval is rounded up to nearest 60s
     evo_data['params'] = dict(hass_config[DOMAIN])
@@ -188,30 +290,36 @@ def setup(hass, hass_config):
 
         _LOGGER.debug("setup(): Configuration parameters: %s", tmp)
 
-    from evohomeclient2 import EvohomeClient
-    _LOGGER.warn("setup(): API call [4 request(s)]: client.__init__()...")       # noqa: E501; pylint: disable=line-too-long; ZXDEL
+    username = evo_data['params'][CONF_USERNAME]
+    client = evo_data['client'] = EvoClient(
+        hass,
+        evo_data['params'][CONF_USERNAME],
+        evo_data['params'][CONF_PASSWORD],
+        evo_data['params'].get(CONF_API_HOST, API_HOST),
+        # polls can back off to max_scan_interval while nothing changes
+        max(evo_data['params'].get(CONF_MAX_SCAN_INTERVAL) or timedelta(0),
+            scan_interval)
+    )
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, client.async_close)
+    await client.async_load_tokens()  # so a restart needn't re-authenticate
+
+    # Use the installation snapshot, if any, so that startup isn't delayed by
+    # the vendor's servers (the snapshot is refreshed once HA has started)
+    installation_store = Store(
+        hass, STORAGE_VERSION, STORAGE_KEY_INSTALLATION)
+    snapshot = load_installation(
+        await installation_store.async_load(), username)
 
     try:
-        client = evo_data['client'] = EvohomeClient(
-            evo_data['params'][CONF_USERNAME],
-            evo_data['params'][CONF_PASSWORD],
-            # debug=False
-        )
-
-    except requests.exceptions.ConnectionError as err:
-        _LOGGER.error(
-            "setup(): Failed to connect with the vendor's web servers. "
-            "This is a networking error, possibly at the vendor's end. "
-            "Unable to continue. Resolve any errors and restart HA."
-        )
-        _LOGGER.error("setup(): The error message is: %s", err)
-        _LOGGER.error(
-            "setup(): For more help, see: https://github.com/zxdavb/evohome"
-        )
-        return False  # unable to continue
+        if snapshot is None:
+            _LOGGER.warn("setup(): API call [3 request(s)]: client.installation_info()...")  # noqa: E501; pylint: disable=line-too-long; ZXDEL
+            installation_info = await client.async_installation_info()
+        else:
+            _LOGGER.debug("setup(): Using the (stored) installation snapshot")
+            installation_info = snapshot
 
-    except requests.exceptions.HTTPError as err:
-        if err.response.status_code == HTTP_BAD_REQUEST:
+    except aiohttp.ClientResponseError as err:
+        if err.status == HTTP_BAD_REQUEST:
             _LOGGER.error(
                 "setup(): Failed to connect with the vendor's web servers. "
                 "Check your username (%s), and password are correct. "
@@ -219,14 +327,14 @@ def setup(hass, hass_config):
                 evo_data['params'][CONF_USERNAME]
             )
 
-        elif err.response.status_code == HTTP_SERVICE_UNAVAILABLE:
+        elif err.status == HTTP_SERVICE_UNAVAILABLE:
             _LOGGER.error(
                 "setup(): Failed to connect with the vendor's web servers. "
                 "The server is not contactable. Unable to continue. "
                 "Resolve any errors and restart HA."
             )
 
-        elif err.response.status_code == HTTP_TOO_MANY_REQUESTS:
+        elif err.status == HTTP_TOO_MANY_REQUESTS:
             _LOGGER.error(
                 "setup(): Failed to connect with the vendor's web servers. "
                 "You have exceeded the API rate limit. Unable to continue. "
@@ -234,12 +342,27 @@ def setup(hass, hass_config):
             )
 
         else:
-            raise  # we don't expect/handle any other HTTPErrors
+            await client.async_close()
+            raise  # we don't expect/handle any other HTTP errors
+
+        _LOGGER.error("setup(): The error message is: %s", err)
+        _LOGGER.error(
+            "setup(): For more help, see: https://github.com/zxdavb/evohome"
+        )
+        await client.async_close()  # else its session (pool) is left open
+        return False  # unable to continue
 
+    except aiohttp.ClientError as err:
+        _LOGGER.error(
+            "setup(): Failed to connect with the vendor's web servers. "
+            "This is a networking error, possibly at the vendor's end. "
+            "Unable to continue. Resolve any errors and restart HA."
+        )
         _LOGGER.error("setup(): The error message is: %s", err)
         _LOGGER.error(
             "setup(): For more help, see: https://github.com/zxdavb/evohome"
         )
+        await client.async_close()
         return False  # unable to continue
 
     finally:  # Redact username, password as no longer needed
@@ -247,21 +370,26 @@ def setup(hass, hass_config):
         evo_data['params'][CONF_PASSWORD] = 'REDACTED'
 
     evo_data['schedules'] = {}
-    evo_data['status'] = {}
 
-    # Redact any installation data we'll never need
-    for loc in client.installation_info:
-        loc['locationInfo']['locationId'] = 'REDACTED'
-        loc['locationInfo']['locationOwner'] = 'REDACTED'
-        loc['locationInfo']['streetAddress'] = 'REDACTED'
-        loc['locationInfo']['city'] = 'REDACTED'
-        loc[GWS][0]['gatewayInfo'] = 'REDACTED'
+    if evo_data['params'][CONF_USE_SCHEDULES]:
+        evo_data['schedule_store'] = Store(
+            hass, STORAGE_VERSION, STORAGE_KEY_SCHEDULES)
+        evo_data['schedules'] = load_schedules(
+            await evo_data['schedule_store'].async_load())
+
+    if snapshot is None:
+        redact_installation(installation_info)
+        await installation_store.async_save(
+            save_installation(installation_info, username))
 
-    # Pull down the installation configuration
+    # Pull down the installation configuration, of one/all of the locations
     loc_idx = evo_data['params'][CONF_LOCATION_IDX]
 
     try:
-        evo_data['config'] = client.installation_info[loc_idx]
+        if loc_idx is None:
+            locations = installation_info
+        else:
+            locations = [installation_info[loc_idx]]
 
     except IndexError:
         _LOGGER.error(
@@ -270,28 +398,36 @@ def setup(hass, hass_config):
             "Check your configuration, resolve any errors and restart HA.",
             CONF_LOCATION_IDX,
             loc_idx,
-            len(client.installation_info) - 1
+            len(installation_info) - 1
         )
 
         _LOGGER.error(
             "setup(): For more help, see: https://github.com/zxdavb/evohome"
         )
+        await client.async_close()
         return False  # unable to continue
 
-    if _LOGGER.isEnabledFor(logging.DEBUG):
-        _LOGGER.debug(
-            "setup(): The location (temperature control system) "
-            "used is: %s [%s] (%s [%s])",
-            evo_data['config']['locationInfo']['locationId'],
-            evo_data['config']['locationInfo']['name'],
-            evo_data['config'][GWS][0][TCS][0]['systemId'],
-            evo_data['config'][GWS][0][TCS][0]['modelType']
-        )
-        # Some of this data needs further redaction before being logged
-        tmp_loc = dict(evo_data['config'])
-        tmp_loc['locationInfo']['postcode'] = 'REDACTED'
+    # each location has its own controller, with its own status and timers
+    evo_data['locations'] = []
+
+    for loc_config in locations:
+        evo_data['locations'].append(location_data(loc_config))
 
-        _LOGGER.debug("setup(): evo_data['config']=%s", tmp_loc)
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug(
+                "setup(): A location (temperature control system) "
+                "used is: %s [%s] (%s [%s])",
+                loc_config['locationInfo']['locationId'],
+                loc_config['locationInfo']['name'],
+                loc_config[GWS][0][TCS][0]['systemId'],
+                loc_config[GWS][0][TCS][0]['modelType']
+            )
+            # Some of this data needs further redaction before being logged
+            tmp_loc = dict(loc_config)
+            tmp_loc['locationInfo'] = dict(loc_config['locationInfo'])
+            tmp_loc['locationInfo']['postcode'] = 'REDACTED'
+
+            _LOGGER.debug("setup(): location config = %s", tmp_loc)
 
     if evo_data['params'][CONF_USE_HEURISTICS]:
         _LOGGER.warning(
@@ -300,35 +436,1088 @@ def setup(hass, hass_config):
             CONF_USE_HEURISTICS
         )
 
-    load_platform(hass, 'climate', DOMAIN, {}, hass_config)
+    hass.async_create_task(async_load_platform(
+        hass, 'climate', DOMAIN, {}, hass_config))
+    hass.async_create_task(async_load_platform(
+        hass, 'sensor', DOMAIN, {}, hass_config))
+
+    if any('dhw' in loc['config'][GWS][0][TCS][0]  # if any location has DHW
+           for loc in evo_data['locations']):
+        hass.async_create_task(async_load_platform(
+            hass, 'water_heater', DOMAIN, {}, hass_config))
+
+    async def _async_refresh_snapshot():
+        """Refresh the installation snapshot, which setup() has used."""
+        _LOGGER.warn("setup(): API call [3 request(s)]: client.installation_info()...")  # noqa: E501; pylint: disable=line-too-long; ZXDEL
+        try:
+            installation_info = redact_installation(
+                await client.async_installation_info())
 
-    if 'dhw' in evo_data['config'][GWS][0][TCS][0]:  # if this location has DHW
-        load_platform(hass, 'water_heater', DOMAIN, {}, hass_config)
+        except aiohttp.ClientError as err:
+            _LOGGER.warning(
+                "setup(): Failed to refresh the installation snapshot, so "
+                "continuing with it as it is. The error message is: %s",
+                err
+            )
+            return
+
+        if installation_info != snapshot:
+            _LOGGER.warning(
+                "setup(): The installation has changed since it was last "
+                "stored (e.g. a zone has been added/removed). Restart HA to "
+                "use the changes."
+            )
+            await installation_store.async_save(
+                save_installation(installation_info, username))
+
+    async def _async_first_update():
+        # the snapshot is refreshed first (this also authenticates the client)
+        if snapshot is not None:
+            await _async_refresh_snapshot()
+
+        pkt = {'sender': 'setup()', 'signal': 'refresh', 'to': EVO_PARENT}
+        async_dispatcher_send(hass, DISPATCHER_EVOHOME, pkt)
 
     @callback
     def _first_update(event):                                                    # noqa: E501; pylint: disable=line-too-long, unused-argument
         # When HA has started, the hub knows to retrieve it's first update
-        pkt = {'sender': 'setup()', 'signal': 'refresh', 'to': EVO_PARENT}
-        async_dispatcher_send(hass, DISPATCHER_EVOHOME, pkt)
+        hass.async_create_task(_async_first_update())
 
-    hass.bus.listen(EVENT_HOMEASSISTANT_START, _first_update)
+    hass.bus.async_listen(EVENT_HOMEASSISTANT_START, _first_update)
 
     return True
 
 
+def location_data(loc_config):
+    """Return the (initial) data of a location, shared by its entities."""
+    return {
+        'config': loc_config,
+        'status': None,  # a SystemStatus, once there has been a poll
+        'timers': {},
+        'zone_ids': (),
+        'zone_idx': {},  # zoneId -> index of the zone's status
+        'generation': 0,  # incremented whenever the status changes
+        'pending': {},  # device id -> PendingCommand (i.e. writes)
+    }
+
+
+def local_now():
+    """Return the current (naive) local time, in HA's time zone.
+
+    Schedules are in local time, and naive datetimes (e.g. until) are taken
+    to be in HA's time zone, which isn't necessarily that of the host (i.e.
+    of datetime.now()).
+    """
+    return dt_now().replace(tzinfo=None)
+
+
+def format_until(until):
+    """Return a (local) datetime as the API's UTC timestamp, e.g. for until.
+
+    The API (and so the status) has until in UTC, and a naive datetime is in
+    HA's time zone (see: local_now()), so it is converted rather than just
+    given a 'Z'.
+    """
+    return as_utc(until).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class EvoClient:
+    """An asyncio client for the vendor's (v1 and v2) web APIs.
+
+    All API I/O is done via a single, pooled aiohttp session, so that polls and
+    commands never hold an executor thread. The v2 access token, and the v1
+    session id, are re-used until they expire (or are rejected).
+    """
+
+    def __init__(self, hass, username, password, host=API_HOST,
+                 poll_interval=SCAN_INTERVAL_DEFAULT):
+        """Initialize the client (this does no I/O).
+
+        Idle connections are kept alive for longer than the poll interval, so
+        that each poll can re-use the connections of the one before it.
+        """
+        self.username = username
+        self.password = password  # is needed to re-authenticate
+        self._host = host
+
+        self.access_token = None
+        self.access_token_expires = datetime.min
+        self.refresh_token = None
+        self._user_id = None
+        self._login_lock = asyncio.Lock(loop=hass.loop)
+        self._token_store = Store(hass, STORAGE_VERSION, STORAGE_KEY_TOKENS)
+
+        self._session_id_v1 = None
+        self._user_id_v1 = None
+        self._locations_v1 = None  # locationId -> v1 location (all devices)
+        self._locations_v1_updated = 0
+        self._locations_v1_lock = asyncio.Lock(loop=hass.loop)
+
+        self.budget = EvoBudget()
+
+        self.connections_created = 0  # see: connection_stats
+        self.connections_reused = 0
+        self._endpoint_limits = {
+            k: asyncio.Semaphore(v, loop=hass.loop)
+            for k, v in API_ENDPOINT_LIMITS.items()
+        }
+
+        keepalive_timeout = \
+            poll_interval.total_seconds() + API_KEEPALIVE_MARGIN
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(
+            self._async_on_connection_create)
+        trace_config.on_connection_reuseconn.append(
+            self._async_on_connection_reuse)
+
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=API_MAX_CONNECTIONS,
+                keepalive_timeout=keepalive_timeout,
+                loop=hass.loop
+            ),
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=API_CONNECT_TIMEOUT,
+                sock_read=API_READ_TIMEOUT
+            ),
+            trace_configs=[trace_config],
+            loop=hass.loop
+        )
+
+    async def _async_on_connection_create(self, session, context, params):      # noqa: E501; pylint: disable=unused-argument
+        self.connections_created += 1
+
+    async def _async_on_connection_reuse(self, session, context, params):       # noqa: E501; pylint: disable=unused-argument
+        self.connections_reused += 1
+
+    @property
+    def connection_stats(self):
+        """Return the statistics of the (shared) connection pool."""
+        total = self.connections_created + self.connections_reused
+        return {
+            'connections_created': self.connections_created,
+            'connections_reused': self.connections_reused,
+            'connection_reuse': round(
+                self.connections_reused / total, 2) if total else None,
+        }
+
+    async def async_load_tokens(self):
+        """Load the (stored) tokens & ids, if they are of the same account.
+
+        So that a restart doesn't need a password grant (i.e. the access token
+        is re-used until it expires, and then the refresh token is used).
+        """
+        tokens = await self._token_store.async_load()
+        if not tokens or tokens.get('account') != account_hash(self.username):
+            return
+
+        self.access_token = tokens['access_token']
+        self.access_token_expires = \
+            parse_datetime(tokens['access_token_expires']) or datetime.min
+        self.refresh_token = tokens['refresh_token']
+        self._user_id = tokens['user_id']
+        self._session_id_v1 = tokens['session_id_v1']
+        self._user_id_v1 = tokens['user_id_v1']
+
+        _LOGGER.debug(
+            "async_load_tokens(): loaded tokens, the access token expires %s",
+            self.access_token_expires
+        )
+
+    def _save_tokens(self):
+        """Store the tokens & ids (after a short delay, to batch writes)."""
+        self._token_store.async_delay_save(lambda: {
+            'account': account_hash(self.username),
+            'access_token': self.access_token,
+            'access_token_expires': self.access_token_expires.isoformat(),
+            'refresh_token': self.refresh_token,
+            'user_id': self._user_id,
+            'session_id_v1': self._session_id_v1,
+            'user_id_v1': self._user_id_v1,
+        }, TOKEN_SAVE_DELAY)
+
+    async def async_close(self, event=None):                                     # noqa: E501; pylint: disable=unused-argument
+        """Close the client's session (and its pooled connections)."""
+        await self._session.close()
+
+    async def _async_request(self, method, url, write=False, raw=False,
+                             endpoint=None, **kwargs):
+        """Make a request of the vendor's API and return its (JSON) response.
+
+        If raw is True, the response is returned as text (i.e. not parsed).
+        The endpoint is its class (by default, a write or a status), which
+        limits how many of the pool's connections it can use at a time.
+
+        Raises an aiohttp.ClientResponseError if the response is an error, an
+        EvoRequestDeferred if the request budget is spent, and an
+        aiohttp.ClientError for any other failure (including timeouts).
+        """
+        self.budget.acquire(write)
+
+        if endpoint is None:
+            endpoint = API_ENDPOINT_WRITE if write else API_ENDPOINT_STATUS
+
+        try:
+            async with self._endpoint_limits[endpoint], \
+                    self._session.request(
+                        method, self._host + url, **kwargs) as resp:
+                if resp.status in (HTTP_TOO_MANY_REQUESTS,
+                                   HTTP_SERVICE_UNAVAILABLE):
+                    self.budget.backoff()
+                resp.raise_for_status()
+                text = await resp.text()
+
+        except asyncio.TimeoutError as err:
+            raise aiohttp.ServerTimeoutError(
+                "Timeout on {} {}".format(method, url)) from err
+
+        self.budget.success()
+        if raw:
+            return text
+        return json.loads(text) if text else None
+
+    async def _async_obtain_token(self, credentials):
+        """Obtain a (v2) access token, using the supplied credentials."""
+        headers = {
+            'Authorization': API_V2_AUTH,
+            'Accept': 'application/json, application/xml, text/json, '
+                      'text/x-json, text/javascript, text/xml',
+        }
+        data = {
+            'Content-Type': 'application/x-www-form-urlencoded; '
+                            'charset=utf-8',
+            'Host': 'rs.alarmnet.com/',
+            'Cache-Control': 'no-store no-cache',
+            'Pragma': 'no-cache',
+            'Connection': 'Keep-Alive',
+        }
+        data.update(credentials)
+
+        # authentication is needed for writes too, so it isn't deferrable
+        token = await self._async_request(
+            'POST', API_AUTH_URL, write=True, endpoint=API_ENDPOINT_AUTH,
+            data=data, headers=headers)
+
+        self.access_token = token['access_token']
+        self.access_token_expires = datetime.now() + \
+            timedelta(seconds=token['expires_in'])
+        self.refresh_token = token['refresh_token']
+        self._save_tokens()
+
+    async def async_login(self):
+        """Obtain a (v2) access token, via the refresh token if possible.
+
+        The password grant is used only if there is no (valid) refresh token.
+        """
+        if self.refresh_token is not None:
+            _LOGGER.debug("async_login(): Using the refresh token...")
+            try:
+                await self._async_obtain_token({
+                    'grant_type': 'refresh_token',
+                    'scope': API_V2_SCOPE,
+                    'refresh_token': self.refresh_token,
+                })
+                return
+
+            except aiohttp.ClientResponseError as err:
+                if err.status not in (HTTP_BAD_REQUEST, HTTP_UNAUTHORIZED):
+                    raise
+                self.refresh_token = None  # it has been revoked, or expired
+
+        _LOGGER.debug("async_login(): Using the username/password...")
+        await self._async_obtain_token({
+            'grant_type': 'password',
+            'scope': API_V2_SCOPE + ' EMEA-V1-Get-Current-User-Account',
+            'Username': self.username,
+            'Password': self.password,
+        })
+
+    async def _async_request_v2(self, method, url, write=False, **kwargs):
+        """Make a request of the v2 API, authenticating if required.
+
+        The access token (which may have been stored) is re-used until it
+        expires, or until the vendor rejects it (e.g. it has been revoked),
+        when the client will re-authenticate (once).
+        """
+        for attempt in range(2):
+            # concurrent requests must not each (re-)authenticate
+            async with self._login_lock:
+                if self.access_token is None or \
+                        datetime.now() > self.access_token_expires - \
+                        timedelta(seconds=30):
+                    await self.async_login()
+                access_token = self.access_token
+
+            headers = {
+                'Authorization': 'bearer ' + access_token,
+                'Accept': 'application/json, application/xml, text/json, '
+                          'text/x-json, text/javascript, text/xml',
+            }
+
+            try:
+                return await self._async_request(
+                    method, API_V2_URL + url, write=write, headers=headers,
+                    **kwargs)
+
+            except aiohttp.ClientResponseError as err:
+                if err.status != HTTP_UNAUTHORIZED or attempt > 0:
+                    raise
+                if self.access_token == access_token:  # else it's been renewed
+                    self.access_token = None  # it has been rejected
+
+    async def async_installation_info(self):
+        """Return the installation info (config) of the user's locations."""
+        if self._user_id is None:
+            user_account = await self._async_request_v2('GET', 'userAccount')
+            self._user_id = user_account['userId']
+            self._save_tokens()
+
+        return await self._async_request_v2(
+            'GET',
+            'location/installationInfo?userId={}'
+            '&includeTemperatureControlSystems=True'.format(self._user_id)
+        )
+
+    async def async_location_status(self, location_id, last_hash=None):
+        """Return the status of a location (its controller, zones & DHW).
+
+        Returns a tuple of (hash, status). If the hash of the response is
+        last_hash (i.e. it is unchanged), it isn't parsed, and status is None.
+        """
+        text = await self._async_request_v2(
+            'GET',
+            'location/{}/status'
+            '?includeTemperatureControlSystems=True'.format(location_id),
+            raw=True
+        )
+
+        text_hash = hashlib.md5(text.encode()).hexdigest()
+        if text_hash == last_hash:
+            return text_hash, None
+        return text_hash, json.loads(text)
+
+    async def async_schedule(self, zone_type, zone_id):
+        """Return the schedule of a zone/DHW, in the evohomeclient2 format."""
+        schedule = json.dumps(await self._async_request_v2(
+            'GET', '{}/{}/schedule'.format(zone_type, zone_id),
+            endpoint=API_ENDPOINT_SCHEDULE))
+
+        for old_key, new_key in SCHEDULE_KEYS:
+            schedule = schedule.replace(old_key, new_key)
+        schedule = json.loads(schedule)
+
+        # change the day name string to a number offset (0 = Monday)
+        for day in schedule['DailySchedules']:
+            day['DayOfWeek'] = DAYS_OF_WEEK.index(day['DayOfWeek'])
+
+        return schedule
+
+    async def async_set_zone_setpoint(self, zone_id, temperature, until=None):
+        """Override the setpoint of a zone, either temporarily, or not."""
+        if until is None:
+            data = {
+                'SetpointMode': EVO_PERMOVER,
+                'HeatSetpointValue': temperature,
+                'TimeUntil': None
+            }
+        else:
+            data = {
+                'SetpointMode': EVO_TEMPOVER,
+                'HeatSetpointValue': temperature,
+                'TimeUntil': format_until(until)
+            }
+
+        return await self._async_request_v2(
+            'PUT',
+            'temperatureZone/{}/heatSetpoint'.format(zone_id),
+            write=True,
+            json=data
+        )
+
+    async def async_cancel_zone_override(self, zone_id):
+        """Revert a zone to following its schedule."""
+        data = {
+            'SetpointMode': EVO_FOLLOW,
+            'HeatSetpointValue': 0.0,
+            'TimeUntil': None
+        }
+
+        return await self._async_request_v2(
+            'PUT',
+            'temperatureZone/{}/heatSetpoint'.format(zone_id),
+            write=True,
+            json=data
+        )
+
+    async def async_set_tcs_mode(self, system_id, mode):
+        """Set the (permanent) operating mode of a controller."""
+        data = {'SystemMode': mode, 'TimeUntil': None, 'Permanent': True}
+
+        return await self._async_request_v2(
+            'PUT',
+            'temperatureControlSystem/{}/mode'.format(system_id),
+            write=True,
+            json=data
+        )
+
+    async def async_set_dhw_state(self, dhw_id, data):
+        """Set the state of a DHW controller."""
+        return await self._async_request_v2(
+            'PUT',
+            'domesticHotWater/{}/state'.format(dhw_id),
+            write=True,
+            json=data
+        )
+
+    async def _async_login_v1(self):
+        """Obtain a (v1) session id."""
+        data = {
+            'Username': self.username,
+            'Password': self.password,
+            'ApplicationId': API_V1_APP_ID
+        }
+
+        user_data = await self._async_request(
+            'POST', API_V1_URL + 'Session', write=True,
+            endpoint=API_ENDPOINT_AUTH, json=data)
+
+        self._session_id_v1 = user_data['sessionId']
+        self._user_id_v1 = user_data['userInfo']['userID']
+        self._save_tokens()
+
+    async def _async_locations_v1(self):
+        """Return all the locations (with their devices), via the v1 API.
+
+        The v1 session id is re-used until the vendor rejects it as expired,
+        when the client will re-authenticate (once).
+        """
+        for attempt in range(2):
+            if self._session_id_v1 is None:
+                await self._async_login_v1()
+
+            try:
+                locations = await self._async_request(
+                    'GET',
+                    API_V1_URL + 'locations/?userId={}'
+                    '&allData=True'.format(self._user_id_v1),
+                    headers={'sessionId': self._session_id_v1}
+                )
+
+            except aiohttp.ClientResponseError as err:
+                if err.status != HTTP_UNAUTHORIZED or attempt > 0:
+                    raise
+                self._session_id_v1 = None  # the session id has expired
+
+            else:
+                return locations
+
+    async def async_temperatures_v1(self, location_id):
+        """Return the (higher-precision) temperatures of a location, via v1.
+
+        A v1 call returns all the locations, so its response is shared by the
+        controllers of each location (for up to API_V1_MAX_AGE seconds). The
+        v1 location is matched by its id, and is empty if there is no match.
+        """
+        async with self._locations_v1_lock:
+            if self._locations_v1 is None or \
+                    monotonic() - self._locations_v1_updated > API_V1_MAX_AGE:
+                self._locations_v1 = {
+                    str(loc['locationID']): loc
+                    for loc in await self._async_locations_v1()
+                }
+                self._locations_v1_updated = monotonic()
+
+        location = self._locations_v1.get(str(location_id))
+        if location is None:
+            return []
+
+        # as evohomeclient: DHW first (if any), then zones ordered by name
+        temperatures = []
+        for device in location['devices']:
+            values = device['thermostat']['changeableValues']
+            temperatures.append({
+                'thermostat': device['thermostatModelType'],
+                'id': device['deviceID'],
+                'name': device['name'],
+                'temp': float(device['thermostat']['indoorTemperature']),
+                'setpoint': float(values['heatSetpoint']['value'])
+                            if 'heatSetpoint' in values else 0,
+            })
+
+        return temperatures
+
+
+class EvoRequestDeferred(aiohttp.ClientError):
+    """The request was not made, as the API request budget is spent.
+
+    This is a ClientError, so it is handled wherever any other client error is.
+    """
+
+
+class EvoBudget:
+    """A request budget for all of the integration's API I/O.
+
+    This is a token bucket, refilled at API_BUDGET_RATE, up to a maximum of
+    API_BUDGET_CAPACITY. Reads are deferred once there are API_BUDGET_RESERVE
+    tokens left, so that those remain for writes. After a 429/503, all
+    requests are deferred for an exponentially increasing (jittered) period.
+    """
+
+    def __init__(self, capacity=API_BUDGET_CAPACITY, rate=API_BUDGET_RATE,
+                 reserve=API_BUDGET_RESERVE):
+        """Initialize the budget (it starts full)."""
+        self.capacity = capacity
+        self.rate = rate
+        self.reserve = reserve
+
+        self._tokens = capacity
+        self._refilled = monotonic()
+
+        self._backoff_count = 0
+        self._backoff_until = 0
+
+        self.requests = 0  # the number of requests made
+        self.deferred = 0  # the number of requests deferred
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._refilled) * self.rate
+        )
+        self._refilled = now
+
+    @property
+    def remaining(self):
+        """Return the number of requests that can be made right now."""
+        self._refill()
+        return int(self._tokens)
+
+    @property
+    def backoff_remaining(self):
+        """Return the number of seconds until requests are allowed again."""
+        return max(0, self._backoff_until - monotonic())
+
+    def acquire(self, write=False):
+        """Use a token for a request, or raise EvoRequestDeferred."""
+        self._refill()
+
+        if self.backoff_remaining:
+            reason = "backing off for another {:.0f} seconds".format(
+                self.backoff_remaining)
+        elif self._tokens < 1 + (0 if write else self.reserve):
+            reason = "the request budget is spent"
+        else:
+            self._tokens -= 1
+            self.requests += 1
+            return
+
+        self.deferred += 1
+        raise EvoRequestDeferred(
+            "The {} was deferred: {}".format(
+                "write" if write else "read", reason))
+
+    def backoff(self):
+        """Defer all requests for a while (the vendor is unable to cope)."""
+        delay = min(
+            API_BACKOFF_MAXIMUM,
+            API_BACKOFF_MINIMUM * 2 ** self._backoff_count
+        )
+        delay = delay / 2 + random.uniform(0, delay / 2)  # add some jitter
+
+        self._backoff_count += 1
+        self._backoff_until = monotonic() + delay
+
+        _LOGGER.debug("backoff(): Deferring all requests for %ss", delay)
+
+    def success(self):
+        """Reset the backoff, as a request has succeeded."""
+        self._backoff_count = 0
+
+
+def compile_schedule(schedule):
+    """Compile a schedule into a week-long timeline of its switchpoints.
+
+    The timeline is a tuple of two lists, sorted by time: the minute-of-week
+    of each switchpoint (0 is Monday 00:00), and the switchpoints themselves.
+    Returns None if there are no switchpoints.
+    """
+    timeline = []
+    for day in schedule.get('DailySchedules', []):
+        for switchpoint in day['Switchpoints']:
+            hours, minutes = switchpoint['TimeOfDay'].split(':')[:2]
+            timeline.append((
+                day['DayOfWeek'] * MINUTES_PER_DAY +
+                int(hours) * 60 + int(minutes),
+                switchpoint
+            ))
+
+    if not timeline:
+        return None
+
+    timeline.sort(key=lambda x: x[0])
+    return [x[0] for x in timeline], [x[1] for x in timeline]
+
+
+def find_switchpoint(timeline, day_time, next_switchpoint=False):
+    """Return the effective (or next) switchpoint of a timeline, and its time.
+
+    The switchpoint is returned as a tuple: (datetime, switchpoint). The
+    timeline (and so the schedule) is not modified.
+    """
+    minutes, switchpoints = timeline
+
+    week_start = (day_time - timedelta(days=day_time.weekday())).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+
+    minute_of_week = day_time.weekday() * MINUTES_PER_DAY + \
+        day_time.hour * 60 + day_time.minute
+
+    # the index of the next switchpoint, the effective one is before that
+    idx = bisect_right(minutes, minute_of_week)
+
+    if next_switchpoint:
+        if idx == len(minutes):  # it is in next week
+            idx, offset = 0, MINUTES_PER_WEEK
+        else:
+            offset = 0
+    else:
+        if idx == 0:  # it is in last week
+            idx, offset = -1, -MINUTES_PER_WEEK
+        else:
+            idx, offset = idx - 1, 0
+
+    return (
+        week_start + timedelta(minutes=minutes[idx] + offset),
+        switchpoints[idx]
+    )
+
+
+def effective_mode(mode, until):
+    """Return the mode in effect, allowing for the expiry of a temporary mode.
+
+    A zone's (or DHW's) TemporaryOverride reverts to FollowSchedule, and a
+    controller's temporary mode (e.g. Away for a few days) reverts to Auto.
+    """
+    if until is None or parse_datetime(until) > utcnow():
+        return mode
+    return EVO_FOLLOW if mode == EVO_TEMPOVER else EVO_AUTO
+
+
+def scheduled_switchpoint(timeline, tcs_op_mode, day_time=None):
+    """Return the switchpoint a schedule has in effect, for a system mode.
+
+    In DayOff mode, it is Saturday's switchpoint. Returns None if there is no
+    timeline (i.e. no schedule), or the mode is Custom (it is unknowable).
+    """
+    if timeline is None or tcs_op_mode == EVO_CUSTOM:
+        return None
+
+    if day_time is None:
+        day_time = local_now()
+
+    if tcs_op_mode == EVO_DAYOFF:
+        day_time = day_time + timedelta(days=5 - day_time.weekday())
+
+    return find_switchpoint(timeline, day_time)[1]
+
+
+def expected_target_temp(params, tcs_op_mode, zone_op_mode, zone_status,
+                         timeline, min_temp):
+    """Return the target temp that a zone is expected to have, else None.
+
+    This is derived locally (i.e. without polling) from the system mode, any
+    override of the zone, and the zone's (cached) schedule, and so is correct
+    in between polls, even as switchpoints pass, or overrides expire. The
+    modes are as per effective_mode().
+    """
+    if tcs_op_mode == EVO_AWAY:
+        # default 'Away' temp is 15C, but can be set otherwise
+        # TBC: set to CONF_AWAY_TEMP even if set setpoint is lower
+        return params[CONF_AWAY_TEMP]
+
+    if tcs_op_mode == EVO_HEATOFF:
+        # default 'HeatingOff' temp is 5C, but can be set higher
+        # the target temp can't be less than a zone's minimum setpoint
+        return max(params[CONF_OFF_TEMP], min_temp)
+
+    if zone_op_mode != EVO_FOLLOW:
+        return zone_status.target_temp  # the override (it hasn't expired)
+
+    switchpoint = scheduled_switchpoint(timeline, tcs_op_mode)
+    if switchpoint is None:
+        return None  # target temps unknowable, must await update()
+
+    temp = switchpoint['heatSetpoint']
+    if tcs_op_mode == EVO_AUTOECO and temp > 16.0:
+        # target temp is relative to the scheduled setpoints, with
+        #  - setpoint => 16.5, target temp = (setpoint - 3)
+        #  - setpoint <= 16.0, target temp = (setpoint - 0)!
+        temp = temp - 3
+    return temp
+
+
+def expected_dhw_state(tcs_op_mode, dhw_op_mode, dhw_status, timeline):
+    """Return the state (On/Off) a DHW controller is expected to have.
+
+    As for expected_target_temp(), but for a DHW controller. Returns None if
+    the state is unknowable.
+    """
+    if dhw_op_mode != EVO_FOLLOW:
+        return dhw_status.state  # the override (it hasn't expired)
+
+    if tcs_op_mode == EVO_AWAY:
+        return DHW_STATES[STATE_OFF]  # DHW is turned off in Away mode
+
+    switchpoint = scheduled_switchpoint(timeline, tcs_op_mode)
+    if switchpoint is None:
+        return None
+    return switchpoint['DhwState']
+
+
+def schedule_hash(schedule):
+    """Return a hash of a schedule's content."""
+    return hashlib.md5(
+        json.dumps(schedule, sort_keys=True).encode()).hexdigest()
+
+
+def redact_installation(installation_info):
+    """Redact any installation data we'll never need (locationId is needed).
+
+    The installation info is redacted in place (and returned), and so can be
+    stored (and logged) without the user's personal data.
+    """
+    for loc in installation_info:
+        loc['locationInfo']['locationOwner'] = 'REDACTED'
+        loc['locationInfo']['streetAddress'] = 'REDACTED'
+        loc['locationInfo']['city'] = 'REDACTED'
+        loc['locationInfo']['postcode'] = 'REDACTED'
+        loc[GWS][0]['gatewayInfo'] = 'REDACTED'
+    return installation_info
+
+
+def account_hash(username):
+    """Return a hash of the account's username (it is not stored as is)."""
+    return hashlib.md5(username.lower().encode()).hexdigest()
+
+
+def load_installation(cache, username):
+    """Return the installation info from a (stored) snapshot, else None.
+
+    The snapshot is used only if it is of the same account (username).
+    """
+    if not cache or cache.get('account') != account_hash(username):
+        return None
+
+    _LOGGER.debug(
+        "load_installation(): loaded a snapshot from %s", cache['updated'])
+    return cache['installation']
+
+
+def save_installation(installation_info, username):
+    """Return the (redacted) installation info in the format to be stored."""
+    return {
+        'account': account_hash(username),
+        'updated': datetime.now().isoformat(),
+        'installation': installation_info,
+    }
+
+
+def load_schedules(cache):
+    """Return the schedules from a (stored) cache, if they are fresh enough.
+
+    Schedules older than SCHEDULE_CACHE_MAX_AGE are discarded. The others are
+    used straight away, and will be revalidated (re-fetched) in due course.
+    """
+    schedules = {}
+    for zone_id, entry in (cache or {}).items():
+        updated = parse_datetime(entry['updated'])
+        if updated is None or updated < datetime.now() - \
+                SCHEDULE_CACHE_MAX_AGE:
+            continue
+
+        schedules[zone_id] = {
+            'schedule': entry['schedule'],
+            'hash': entry['hash'],
+            'updated': updated,
+            'timeline': compile_schedule(entry['schedule']),
+        }
+
+    _LOGGER.debug("load_schedules(): loaded %s schedule(s)", len(schedules))
+    return schedules
+
+
+def save_schedules(schedules):
+    """Return the schedules in the format to be stored (cached)."""
+    return {
+        zone_id: {
+            'schedule': entry['schedule'],
+            'hash': entry['hash'],
+            'updated': entry['updated'].isoformat(),
+        } for zone_id, entry in schedules.items()
+        if entry.get('schedule') and entry.get('zone_type')
+    }
+
+
+class EvoRecord:
+    """Base for the compact (parsed) records of the API's JSON.
+
+    Records are compared by value (e.g. to detect that a zone has changed), and
+    are exposed (e.g. as state attributes) via as_dict().
+    """
+
+    __slots__ = ()
+
+    def as_dict(self):
+        """Return the record as a dict (e.g. for logging, or attributes)."""
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def as_tuple(self):
+        """Return the record's (current) values, e.g. to compare it later."""
+        return tuple(getattr(self, k) for k in self.__slots__)
+
+    def __eq__(self, other):
+        """Return True if the other record has the same values."""
+        return type(self) is type(other) and all(
+            getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    def __repr__(self):
+        """Return the record as a string (e.g. for logging)."""
+        return "{}({})".format(type(self).__name__, self.as_dict())
+
+
+class ZoneConfig(EvoRecord):
+    """The config of a heating zone, from the installation info."""
+
+    __slots__ = (
+        'zone_id', 'name', 'zone_type', 'model_type',
+        'min_temp', 'max_temp', 'temp_step',
+    )
+
+    def __init__(self, config):
+        """Parse the JSON config of a zone."""
+        capabilities = config['setpointCapabilities']
+
+        self.zone_id = config['zoneId']
+        self.name = config['name']
+        self.zone_type = config['zoneType']
+        self.model_type = config['modelType']
+        self.min_temp = capabilities['minHeatSetpoint']
+        self.max_temp = capabilities['maxHeatSetpoint']
+        self.temp_step = capabilities['valueResolution']
+
+
+class ZoneStatus(EvoRecord):
+    """The status of a heating zone (its v2 status, joined to its v1 temp)."""
+
+    __slots__ = (
+        'zone_id', 'is_available', 'temperature', 'setpoint_mode',
+        'target_temp', 'until', 'temp_v1', 'setpoint_v1', 'precision_source',
+        'active_faults',
+    )
+
+    def __init__(self, status):
+        """Parse the JSON (v2) status of a zone."""
+        temperature = status['temperatureStatus']
+        setpoint = status['setpointStatus']
+
+        self.zone_id = status['zoneId']
+        self.is_available = bool(temperature['isAvailable'])
+        self.temperature = temperature.get('temperature')
+        self.setpoint_mode = setpoint['setpointMode']
+        self.target_temp = setpoint['targetHeatTemperature']
+        self.until = setpoint.get('until')
+        self.temp_v1 = None
+        self.setpoint_v1 = None
+        self.precision_source = SOURCE_V2
+        self.active_faults = tuple(
+            f.get('faultType') for f in status.get('activeFaults', []))
+
+
+class DhwStatus(EvoRecord):
+    """The status of a DHW controller (its v2 status, with its v1 temp)."""
+
+    __slots__ = (
+        'dhw_id', 'is_available', 'temperature', 'state', 'mode', 'until',
+        'temp_v1', 'precision_source', 'active_faults',
+    )
+
+    def __init__(self, status):
+        """Parse the JSON (v2) status of a DHW controller."""
+        temperature = status['temperatureStatus']
+        state = status['stateStatus']
+
+        self.dhw_id = status['dhwId']
+        self.is_available = bool(temperature['isAvailable'])
+        self.temperature = temperature.get('temperature')
+        self.state = state['state']
+        self.mode = state['mode']
+        self.until = state.get('until')
+        self.temp_v1 = None
+        self.precision_source = SOURCE_V2
+        self.active_faults = tuple(
+            f.get('faultType') for f in status.get('activeFaults', []))
+
+
+class SystemStatus(EvoRecord):
+    """The status of a controller, with the status of its zones and DHW."""
+
+    __slots__ = (
+        'system_id', 'mode', 'is_permanent', 'until', 'zones', 'dhw',
+        'active_faults',
+    )
+
+    def __init__(self, status):
+        """Parse the JSON (v2) status of a controller (its TCS)."""
+        self.system_id = status['systemId']
+        self.mode = status['systemModeStatus']['mode']
+        self.is_permanent = status['systemModeStatus'].get('isPermanent')
+        self.until = status['systemModeStatus'].get('timeUntil')
+        self.zones = [ZoneStatus(zone) for zone in status.get('zones', [])]
+        self.dhw = DhwStatus(status['dhw']) if 'dhw' in status else None
+        self.active_faults = tuple(
+            f.get('faultType') for f in status.get('activeFaults', []))
+
+    def as_dict(self):
+        """Return the record as a dict, without its zones/DHW."""
+        data = super().as_dict()
+        data['zones'] = len(self.zones)
+        data['dhw'] = self.dhw is not None
+        return data
+
+
+class PendingCommand(EvoRecord):
+    """A write (command) to a device, that a poll hasn't yet confirmed.
+
+    The intent is the (status) values that the write should result in, and
+    the previous values are those of the last poll before it.  The effects are
+    other values that are only expected of the write (e.g. the scheduled
+    target temp of a zone that is to follow its schedule), and so they are
+    overlaid (and reverted), but a poll isn't expected to confirm them.
+    """
+
+    __slots__ = (
+        'device_id', 'entity_id', 'intent', 'effects', 'previous', 'issued',
+        'expires',
+    )
+
+    def __init__(self, device_id, entity_id, intent, previous, effects=None):
+        """Initialize the command, as issued now."""
+        self.device_id = device_id
+        self.entity_id = entity_id
+        self.intent = intent
+        self.effects = {} if effects is None else effects
+        self.previous = previous
+        self.issued = datetime.now()
+        self.expires = self.issued + COMMAND_EXPIRY
+
+    def overlay(self, record):
+        """Overlay the intent onto a status record (optimistically)."""
+        for key, value in self.effects.items():
+            setattr(record, key, value)
+        for key, value in self.intent.items():
+            setattr(record, key, value)
+
+    def reconcile(self, record, now):
+        """Return the outcome of the command, given a (newly polled) record.
+
+        Returns None if the command is still pending (i.e. the record is as
+        it was before the write, and the command hasn't expired).
+        """
+        polled = {k: getattr(record, k) for k in self.intent}
+
+        if polled == self.intent:
+            return CMD_CONFIRMED
+        if now > self.expires:
+            return CMD_TIMED_OUT
+        if polled != {k: self.previous[k] for k in self.intent}:
+            return CMD_CONTRADICTED
+        return None
+
+
+@callback
+def async_fire_command_event(hass, command, result):
+    """Fire an event with the outcome of a (no longer pending) command."""
+    if result == CMD_CONFIRMED:
+        _LOGGER.debug("Command for %s: %s", command.device_id, result)
+    else:
+        _LOGGER.warning(
+            "The write to %s (%s) was not confirmed: %s",
+            command.entity_id,
+            command.intent,
+            result
+        )
+
+    hass.bus.async_fire(EVENT_COMMAND, {
+        'entity_id': command.entity_id,
+        'device_id': command.device_id,
+        'intent': dict(command.intent),
+        'issued': command.issued.isoformat(),
+        'result': result,
+    })
+
+
+def memoized(func):
+    """Memoize a derived property of an entity (e.g. its state).
+
+    The value is computed only once per status generation (i.e. it is
+    re-computed after a poll lands, or a write is applied optimistically), and
+    per minute (e.g. an entity may pass a switchpoint, or become stale).
+    """
+    @functools.wraps(func)
+    def wrapper(self):
+        key = (self._loc_data['generation'], int(time() // 60))
+        if self._memo_key != key:
+            self._memo_key = key
+            self._memo = {}
+
+        if func.__name__ not in self._memo:
+            self._memo[func.__name__] = func(self)
+        return self._memo[func.__name__]
+
+    return wrapper
+
+
+def requires_status(func):
+    """Reject a write to an entity until its first status has arrived.
+
+    A write is applied to the status optimistically (see: _issue_command()),
+    and so it is ignored (with a warning) if there isn't yet a status.
+    """
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        if self._status is None:
+            _LOGGER.warning(
+                "Unable to write to %s, as it has no status yet "
+                "(the first poll hasn't yet been made), so ignoring it",
+                self.entity_id
+            )
+            return None
+        return await func(self, *args, **kwargs)
+
+    return wrapper
+
+
 class EvoDevice(Entity):
     """Base for all Honeywell evohome devices."""
 
     # pylint: disable=no-member
 
-    def __init__(self, evo_data, client, obj_ref):
+    def __init__(self, evo_data, loc_data, client, config):
         """Initialize the evohome entity."""
         self._client = client
-        self._obj = obj_ref
+        self._config = config
 
         self._params = evo_data['params']
-        self._timers = evo_data['timers']
-        self._status = {}
+        self._loc_data = loc_data  # the location of the entity's controller
+        self._timers = loc_data['timers']
+        self._status = None  # a SystemStatus, ZoneStatus or DhwStatus
+
+        self._memo_key = None  # see: memoized()
+        self._memo = {}
+        self._last_values = {}  # so that some things are logged only once
 
         self._available = False  # should become True after first update()
 
@@ -342,44 +1531,111 @@ class EvoDevice(Entity):
 #       _LOGGER.debug("_connect(%s): got packet %s", self._id, packet)
 
         if packet['to'] & self._type and packet['signal'] == 'refresh':
+            # a refresh may be for only some of the children, by id
+            if packet.get('ids') is not None and self._id not in packet['ids']:
+                return
             # for all entity types this must have force_refresh=True
             self.async_schedule_update_ha_state(force_refresh=True)
 
-    def _handle_exception(self, err, err_hint=None):
+    def _status_changed(self):
+        """Invalidate the derived properties of every entity at the location.
+
+        This is done whenever a poll lands, or a write is applied
+        (optimistically), so that they are re-computed when next accessed.
+        """
+        self._loc_data['generation'] += 1
+
+    def _issue_command(self, effects=None, **intent):
+        """Apply a write to the entity's status, optimistically.
+
+        The write is a pending command until a poll confirms it, contradicts
+        it, or it expires (see: EvoController._reconcile_commands()), and
+        meanwhile it is overlaid onto the status of every poll.
+        """
+        pending = self._loc_data['pending']
+        keys = set(intent) | set(effects or {})
+        previous = {k: getattr(self._status, k) for k in keys}
+
+        if self._id in pending:  # it supersedes an earlier (pending) command
+            earlier = pending[self._id].previous
+            previous.update({k: v for k, v in earlier.items() if k in keys})
+
+        command = pending[self._id] = PendingCommand(
+            self._id, self.entity_id, intent, previous, effects)
+        command.overlay(self._status)
+        self._status_changed()
+
+    def _command_failed(self):
+        """Revert the entity's pending command, as its write has failed."""
+        command = self._loc_data['pending'].pop(self._id, None)
+        if command is None:
+            return
+
+        for key, value in command.previous.items():
+            setattr(self._status, key, value)
+        self._status_changed()
+
+        async_fire_command_event(self.hass, command, CMD_FAILED)
+        self.async_schedule_update_ha_state(force_refresh=False)
+
+    def _notify_write(self):
+        """Notify the entity's controller of a write, so it can confirm it."""
+        pkt = {
+            'sender': self._id,
+            'signal': 'written',
+            'to': EVO_PARENT,
+            'ids': [self._loc_data['config'][GWS][0][TCS][0]['systemId']]
+        }
+        async_dispatcher_send(self.hass, DISPATCHER_EVOHOME, pkt)
+
+    def _use_local_setpoints(self):
+        """Return True if targets/states are derived locally, between polls.
+
+        This requires heuristics and schedules (see: expected_target_temp()).
+        """
+        return self._params[CONF_USE_HEURISTICS] and \
+            self._params[CONF_USE_SCHEDULES]
+
+    def _tcs_op_mode(self):
+        """Return the operating mode of the entity's controller."""
+        status = self._loc_data['status']
+        if self._use_local_setpoints():
+            return effective_mode(status.mode, status.until)
+        return status.mode
+
+    def _is_transition(self, key, value):
+        """Return True if this value (e.g. a state) is not the last value."""
+        is_transition = key not in self._last_values or \
+            self._last_values[key] != value
+        self._last_values[key] = value
+        return is_transition
+
+    def _handle_exception(self, err):
         """Return True if the Exception can be handled/ignored."""
         try:
             raise err
 
-# 2/3: evohomeclient2 now (>=0.2.7) exposes requests exceptions, e.g.:
-# - 'Connection aborted.', ConnectionResetError('Connection reset by peer')
-# - "Max retries exceeded with url", caused by "Connection timed out"
-# - NB: takes 5 mins to timeout
-        except requests.exceptions.ConnectionError:
-            # this appears to be common with Honeywell servers
-            _LOGGER.warning(
-                "The vendor's web servers appear to be uncontactable, so "
-                "unable to get the latest state data during this cycle. "
-                "NB: This is often a problem with the vendor's network."
-            )
+# 3/3: the client defers requests if the request budget is spent, or if it is
+# backing off after a 429/503 (so this is how the API rate limit is honoured)
+        except EvoRequestDeferred:
+            _LOGGER.debug("%s", err)
             return True
 
-# 3/3: evohomeclient2 (>=0.2.7) now exposes requests exceptions, e.g.:
-# - "400 Client Error: Bad Request for url" (e.g. Bad credentials)
-# - "429 Client Error: Too Many Requests for url" (api usage limit exceeded)
-# - "503 Client Error: Service Unavailable for url" (e.g. website down)
-        except requests.exceptions.HTTPError:
-            if err.response.status_code == HTTP_TOO_MANY_REQUESTS:
+# 2/3: the client raises aiohttp exceptions for HTTP errors, e.g.:
+# - "400, message='Bad Request'" (e.g. Bad credentials)
+# - "429, message='Too Many Requests'" (api usage limit exceeded)
+# - "503, message='Service Unavailable'" (e.g. website down)
+        except aiohttp.ClientResponseError:
+            if err.status == HTTP_TOO_MANY_REQUESTS:
                 _LOGGER.warning(
                     "The vendor's API rate limit has been exceeded, so "
                     "unable to get the latest state data during this cycle. "
                     "Suspending polling, and will resume after %s seconds.",
-                    (self._params[CONF_SCAN_INTERVAL] * 3).total_seconds()
+                    round(self._client.budget.backoff_remaining)
                 )
-                self._timers['statusUpdated'] = datetime.now() + \
-                    self._params[CONF_SCAN_INTERVAL] * 3
                 return True
 
-            if err.response.status_code == HTTP_SERVICE_UNAVAILABLE:
+            if err.status == HTTP_SERVICE_UNAVAILABLE:
                 # this appears to be common with Honeywell servers
                 _LOGGER.warning(
                     "The vendor's web servers appear unavailable, so "
@@ -388,26 +1644,17 @@ class EvoDevice(Entity):
                 )
                 return True
 
-# 1/3: evohomeclient1 (<=0.2.7) does not have a requests exceptions handler:
-#     File ".../evohomeclient/__init__.py", line 33, in _populate_full_data
-#       userId = self.user_data['userInfo']['userID']
-#   TypeError: list indices must be integers or slices, not str
-
-# but we can (sometimes) extract the response, which may be like this:
-# [{
-#   'code':    'TooManyRequests',
-#   'message': 'Request count limitation exceeded, please try again later.'
-# }]
-
-        except TypeError:
-            if isinstance(err_hint, list) and 'code' in err_hint[0]:
-                if err_hint[0]['code'] == "TooManyRequests":
-                    _LOGGER.warning(
-                        "The vendor's v1 API rate limit has been exceeded, so "
-                        "unable to get higher-precision (v1) temperatures. "
-                        "Continuing with standard (v2) temperatures for now."
-                    )
-                    return True
+# 1/3: ...and other aiohttp exceptions for everything else, e.g.:
+# - "Cannot connect to host", caused by "Connection timed out"
+# - 'Connection reset by peer', or a (client-side) timeout
+        except aiohttp.ClientError:
+            # this appears to be common with Honeywell servers
+            _LOGGER.warning(
+                "The vendor's web servers appear to be uncontactable, so "
+                "unable to get the latest state data during this cycle. "
+                "NB: This is often a problem with the vendor's network."
+            )
+            return True
 
         return False
 
@@ -434,6 +1681,7 @@ class EvoDevice(Entity):
         return self._type == EVO_PARENT
 
     @property
+    @memoized
     def available(self) -> bool:
         """Return True if the device is currently available.
 
@@ -443,30 +1691,35 @@ class EvoDevice(Entity):
 
         However, evohome entities can become unavailable for other reasons.
         """
+        # polls can back off to max_scan_interval while nothing changes
+        poll_interval = max(
+            self._params.get(CONF_MAX_SCAN_INTERVAL) or timedelta(0),
+            self._params[CONF_SCAN_INTERVAL]
+        )
         no_recent_updates = self._timers['statusUpdated'] < datetime.now() - \
-            self._params[CONF_SCAN_INTERVAL] * 3.1
+            poll_interval * 3.1
 
         if no_recent_updates:
             # unavailable because no successful update()s (but why?)
             self._available = False
             debug_code = '0x01'
 
-        elif not self._status:  # self._status == {}
+        elif self._status is None:
             # unavailable because no status (but how? other than at startup?)
             self._available = False
             debug_code = '0x02'
 
-        elif self._status and (self._type & EVO_CHILD):
+        elif self._type & EVO_CHILD:
             # (un)available because (web site via) client api says so
-            self._available = \
-                bool(self._status['temperatureStatus']['isAvailable'])
+            self._available = self._status.is_available
             debug_code = '0x03'  # only used if above is False
 
         else:  # is available
             self._available = True
 
         if not self._available and \
-                self._timers['statusUpdated'] != datetime.min:
+                self._timers['statusUpdated'] != datetime.min and \
+                self._is_transition('available', self._available):
             # this isn't the first (un)available (i.e. after STARTUP)
             _LOGGER.warning(
                 "available(%s) = %s (debug code %s), "
@@ -477,6 +1730,8 @@ class EvoDevice(Entity):
                 self._status,
                 self._timers
             )
+        elif self._available:
+            self._is_transition('available', self._available)
 
 #       _LOGGER.debug("available(%s) = %s", self._id, self._available)            # noqa: E501; pylint: disable=line-too-long; ZXDEL
         return self._available
@@ -524,17 +1779,25 @@ class EvoDevice(Entity):
         return precision
 
     @property
+    @memoized
     def current_operation(self):
-        """Return the current operating mode of the evohome device."""
+        """Return the current operating mode of the evohome device.
+
+        With local setpoints, this allows for the expiry of any temporary mode
+        (or override) since the last poll.
+        """
         if self._type & EVO_PARENT:
-            evo_data = self.hass.data[DATA_EVOHOME]
-            current_operation = evo_data['status']['systemModeStatus']['mode']
+            current_operation = self._tcs_op_mode()
 
         elif self._type & EVO_ZONE:
-            current_operation = self._status['setpointStatus']['setpointMode']
+            current_operation = self._status.setpoint_mode
 
         else:  # self._type & EVO_DHW
-            current_operation = self._status['stateStatus']['mode']
+            current_operation = self._status.mode
+
+        if self._type & EVO_CHILD and self._use_local_setpoints():
+            current_operation = effective_mode(
+                current_operation, self._status.until)
 
         _LOGGER.debug("current_operation(%s) = %s", self._id, current_operation)  # noqa: E501; pylint: disable=line-too-long; ZXDEL
         return current_operation
@@ -549,7 +1812,7 @@ class EvoDevice(Entity):
         if self._type & EVO_PARENT:
             temp = MIN_TEMP
         elif self._type & EVO_ZONE:
-            temp = self._config['setpointCapabilities']['minHeatSetpoint']
+            temp = self._config.min_temp
         elif self._type & EVO_DHW:
             temp = 35
 #       _LOGGER.debug("min_temp(%s) = %s", self._id, temp)                       # noqa: E501; pylint: disable=line-too-long; ZXDEL
@@ -565,7 +1828,7 @@ class EvoDevice(Entity):
         if self._type & EVO_PARENT:
             temp = MAX_TEMP
         elif self._type & EVO_ZONE:
-            temp = self._config['setpointCapabilities']['maxHeatSetpoint']
+            temp = self._config.max_temp
         elif self._type & EVO_DHW:
             temp = 85
 #       _LOGGER.debug("max_temp(%s) = %s", self._id, temp)                       # noqa: E501; pylint: disable=line-too-long; ZXDEL
@@ -577,98 +1840,96 @@ class EvoChildDevice(EvoDevice):
 
     # pylint: disable=no-member
 
-    def __init__(self, evo_data, client, obj_ref):
+    def __init__(self, evo_data, loc_data, client, config):
         """Initialize the evohome evohome Heating/DHW zone."""
-        super().__init__(evo_data, client, obj_ref)
-
-        self._id = obj_ref.zoneId  # is also: obj_ref.dhwId
+        super().__init__(evo_data, loc_data, client, config)
 
-        if self._obj.zone_type == 'temperatureZone':
-            self._name = obj_ref.name
+        if isinstance(config, ZoneConfig):
+            self._id = config.zone_id
+            self._name = config.name
             self._type = EVO_CHILD | EVO_ZONE
             self._icon = "mdi:radiator"
+            self._zone_type = 'temperatureZone'  # as used by the client api
 
-        elif self._obj.zone_type == 'domesticHotWater':
+        else:
+            self._id = config['dhwId']
             self._name = "~DHW"
             self._type = EVO_CHILD | EVO_DHW
             self._icon = "mdi:thermometer-lines"
+            self._zone_type = 'domesticHotWater'
+
+        # the controller refreshes the children's schedules, a few at a time
+        # NB: the schedule may have been loaded from the (stored) cache
+        self._schedule = evo_data['schedules'].setdefault(self._id, {})
+        self._schedule.setdefault('schedule', {})
+        self._schedule.setdefault('hash', None)
+        self._schedule.setdefault('updated', datetime.min)
+        self._schedule.setdefault('timeline', None)
+        self._schedule['zone_type'] = self._zone_type  # as used by the client
 
-        else:  # this should never happen!
-            self._type = EVO_UNKNOWN
+        self._attributes = {}  # see: device_state_attributes()
 
-        self._status = {}
+        self._state_timer_unsub = None  # see: _async_state_timer()
+        self._state_timer_due = None  # as per monotonic()
 
-        # children update their schedules themselves, unlike everything else
-        self._schedule = evo_data['schedules'][self._id] = {}
-        self._schedule['updated'] = datetime.min
+    @callback
+    def _connect(self, packet):
+        """Process a dispatcher connect, re-binding to a re-parsed status."""
+        if packet['to'] & self._type and packet['signal'] == 'refresh':
+            # every child, even if its state hasn't changed (i.e. if it isn't
+            # to be refreshed), else writes would be overlaid onto a stale
+            # record of a superseded status
+            self._bind_status()
+        super()._connect(packet)
+
+    def _bind_status(self):
+        """Point the child's status at its record in the latest status."""
+        loc_data = self._loc_data
+
+        if loc_data['status'] is None:
+            pass  # there hasn't been a successful poll yet
+
+        elif self._type & EVO_ZONE:
+            idx = loc_data['zone_idx'].get(self._id)
+            if idx is not None:
+                self._status = loc_data['status'].zones[idx]
+
+        elif self._type & EVO_DHW:
+            self._status = loc_data['status'].dhw
 
     def _switchpoint(self, day_time=None, next_switchpoint=False):
         # return the switchpoint for a schedule at a particular day/time, for:
         # - heating zones: a time-from, and a target temp
         # - boilers: a time-from, and on (trying to reach target temp)/off
-        schedule = self.schedule
+        # as a tuple of (datetime, switchpoint), or (None, None) if no schedule
+        if self._schedule.get('timeline') is None:
+            return None, None
 
         if day_time is None:
-            day_time = datetime.now()
-        day_of_week = int(day_time.strftime('%w'))  # 0 is Sunday
-        time_of_day = day_time.strftime('%H:%M:%S')
-
-        # start with the last switchpoint of the day before...
-        idx = -1  # last switchpoint of the day before
-
-        # iterate the day's switchpoints until we go past time_of_day...
-        day = schedule['DailySchedules'][day_of_week]
-        for i, tmp in enumerate(day['Switchpoints']):
-            if time_of_day > tmp['TimeOfDay']:
-                idx = i
-            else:
-                break
-
-        # if asked, go for the next switchpoint...
-        if next_switchpoint is True:  # the upcoming switchpoint
-            if idx < len(day['Switchpoints']) - 1:
-                day = schedule['DailySchedules'][day_of_week]
-                switchpoint = day['Switchpoints'][idx + 1]
-                switchpoint_date = day_time
-            else:
-                day = schedule['DailySchedules'][(day_of_week + 1) % 7]
-                switchpoint = day['Switchpoints'][0]
-                switchpoint_date = day_time + timedelta(days=1)
-
-        else:  # the effective switchpoint
-            if idx == -1:
-                day = schedule['DailySchedules'][(day_of_week + 6) % 7]
-                switchpoint = day['Switchpoints'][idx]
-                switchpoint_date = day_time + timedelta(days=-1)
-            else:
-                day = schedule['DailySchedules'][day_of_week]
-                switchpoint = day['Switchpoints'][idx]
-                switchpoint_date = day_time
+            day_time = local_now()
 
-# TBD: remove this
-        # insert day_and_time of the switchpoint for those who want it
-        switchpoint['DateAndTime'] = switchpoint_date.strftime('%Y/%m/%d') + \
-            " " + switchpoint['TimeOfDay']
+        day_time, switchpoint = find_switchpoint(
+            self._schedule['timeline'], day_time, next_switchpoint)
 
-        _LOGGER.warn(
-            "_switchpoint(%s) = %s",
+        _LOGGER.debug(
+            "_switchpoint(%s) = %s, %s",
             self._id + " [" + self._name + "]",
+            day_time,
             switchpoint
         )
-        return switchpoint
+        return day_time, switchpoint
 
     def _next_switchpoint_time(self) -> datetime:
         # until either the next scheduled setpoint, or just an hour from now
+        until = None
+
         if self._params[CONF_USE_SCHEDULES]:
             # get the time of the next scheduled setpoint (switchpoint)
-            switchpoint = self._switchpoint(next_switchpoint=True)
-            # convert back to a datetime object
-            until = datetime.strptime(
-                switchpoint['DateAndTime'], '%Y/%m/%d %H:%M:%S'
-            )  # 'DateAndTime': '2019/01/30 19:10:00'
-        else:
+            until, _ = self._switchpoint(next_switchpoint=True)
+
+        if until is None:
             # there are no schedules, so use an hour from now
-            until = datetime.now() + timedelta(hours=1)
+            until = local_now() + timedelta(hours=1)
 
         return until
 
@@ -689,40 +1950,60 @@ class EvoChildDevice(EvoDevice):
         return self._schedule['schedule']
 
     @property
+    @memoized
     def device_state_attributes(self):
-        """Return the optional device state attributes."""
+        """Return the optional device state attributes.
+
+        Which attributes depends upon the attribute_profile, and only values
+        that change (e.g. not the temperatures, which are already attributes
+        of the entity) are included, except for debug. The same dict is
+        returned until one of its values actually changes.
+        """
+        profile = self._params[CONF_ATTRIBUTE_PROFILE]
         data = {}
-        data['status'] = self._status
-        data['switchpoints'] = {}
 
-        if self._params[CONF_USE_SCHEDULES]:
-            data['switchpoints']['current'] = self._switchpoint()
-            data['switchpoints']['next'] = \
-                self._switchpoint(next_switchpoint=True)
+        if profile == ATTRS_DEBUG:
+            data['status'] = self._status.as_dict()
 
-        _LOGGER.debug("device_state_attributes(%s) = %s", self._id, data)        # noqa: E501; pylint: disable=line-too-long; ZXDEL
-        return data
+        if profile != ATTRS_MINIMAL:
+            data['until'] = self._status.until  # of any override
+            data['active_faults'] = list(self._status.active_faults)
+            data['precision_source'] = self._status.precision_source
 
-    def async_set_operation_mode(self, operation_mode):
-        """Set a new target operation mode.
+        if profile != ATTRS_MINIMAL and self._params[CONF_USE_SCHEDULES]:
+            data['switchpoints'] = {}
+            keys = [('next', True)]
+            if profile == ATTRS_DEBUG:
+                keys.insert(0, ('current', False))
 
-        This method must be run in the event loop and returns a coroutine. The
-        underlying method is not asyncio-friendly.
-        """
-        return self.hass.async_add_job(self.set_operation_mode, operation_mode)  # noqa: E501; pylint: disable=no-member
+            for key, is_next in keys:
+                day_time, switchpoint = self._switchpoint(
+                    next_switchpoint=is_next)
+                if switchpoint is not None:
+                    data['switchpoints'][key] = dict(switchpoint)
+                    data['switchpoints'][key]['DateAndTime'] = \
+                        day_time.strftime('%Y/%m/%d %H:%M:%S')
+
+        if data != self._attributes:
+            self._attributes = data
+        data = self._attributes
+
+        _LOGGER.debug("device_state_attributes(%s) = %s", self._id, data)        # noqa: E501; pylint: disable=line-too-long; ZXDEL
+        return data
 
     @property
+    @memoized
     def current_temperature(self):
         """Return the current temperature of the Heating/DHW zone."""
         # this is used by evoZone, and evoBoiler class, however...
         # evoZone(Entity, ClimateDevice) uses temperature_unit, and
         # evoBoiler(Entity) *also* needs uses unit_of_measurement
 
-        # TBA: this needs work - what if v1 temps failed, or ==128
-        if 'apiV1Status' in self._status:
-            curr_temp = self._status['apiV1Status']['temp']
-        elif self._status['temperatureStatus']['isAvailable']:
-            curr_temp = self._status['temperatureStatus']['temperature']
+        # the v1 temp is present only if it was available (i.e. not 128)
+        if self._status.temp_v1 is not None:
+            curr_temp = self._status.temp_v1
+        elif self._status.is_available:
+            curr_temp = self._status.temperature
         else:
             # this isn't expected as available() should have been False
             curr_temp = None
@@ -736,13 +2017,11 @@ class EvoChildDevice(EvoDevice):
         _LOGGER.debug("current_temperature(%s) = %s", self._id, curr_temp)        # noqa: E501; pylint: disable=line-too-long; ZXDEL
         return curr_temp
 
-    def update(self):
+    async def async_update(self):
         """Get the latest state data of the Heating/DHW zone.
 
-        This includes state data obtained by the controller (e.g. temperature),
-        but also state data obtained directly by the zone (i.e. schedule).
-
-        This is not asyncio-friendly due to the underlying client api.
+        This is state data obtained by the controller (e.g. temperature), and
+        the schedule, which the controller also refreshes.
         """
 # After (say) a controller.set_operation_mode, it will take a while for the
 # 1. (invoked) client api call (request.xxx) to reach the web server,
@@ -751,17 +2030,12 @@ class EvoChildDevice(EvoDevice):
 # 4. controller to send response back to web server
 # 5. we make next client api call (every scan_interval)
 # ... in between 1. & 5., should assumed_state/available/other be True/False?
-        evo_data = self.hass.data[DATA_EVOHOME]
 
-# Part 1: state - create pointers to state as retrieved by the controller
-        if self._type & EVO_ZONE:
-            for _zone in evo_data['status']['zones']:
-                if _zone['zoneId'] == self._id:
-                    self._status = _zone
-                    break
+# Create pointers to state as retrieved by the controller
+        self._bind_status()
 
-        elif self._type & EVO_DHW:
-            self._status = evo_data['status']['dhw']
+        self._memo_key = None  # the status is now that of the latest poll
+        self._set_state_timer()
 
         _LOGGER.debug(
             "update(%s), self._status = %s",
@@ -769,43 +2043,75 @@ class EvoChildDevice(EvoDevice):
             self._status
         )
 
-# Part 2: schedule - retrieved here as required
+        return True
+
+    async def async_will_remove_from_hass(self):
+        """Run when entity will be removed from hass."""
+        if self._state_timer_unsub is not None:
+            self._state_timer_unsub()
+            self._state_timer_unsub = None
+
+    def _next_state_change(self):
+        """Return the seconds until the state is next expected to change.
+
+        This is at the next switchpoint of the schedule, or the expiry of any
+        temporary override (or system mode), whichever is sooner. Returns None
+        if there is no such time.
+        """
+        delays = []
+
         if self._params[CONF_USE_SCHEDULES]:
-#           self._schedule = evo_data['schedules'][self._id]
-
-            # Use cached schedule if < 60 mins old
-            timeout = datetime.now() + timedelta(seconds=59)
-            expired = timeout > self._schedule['updated'] + timedelta(hours=1)
-
-            if expired:  # timer expired, so update schedule
-                if self._type & EVO_ZONE:
-                    _LOGGER.warn(
-                        "update(): API call [1 request(s)]: "
-                        "zone(%s).schedule()...",
-                        self._id
-                    )
-                else:  # elif self._type & EVO_DHW:
-                    _LOGGER.warn(
-                        "update(): API call [1 request(s)]: "
-                        "dhw(%s).schedule()...",
-                        self._id
-                    )
-                self._schedule['schedule'] = {}
-                self._schedule['updated'] = datetime.min
-
-                try:
-                    self._schedule['schedule'] = self._obj.schedule()
-                except requests.exceptions.RequestException as err:
-                    if not self._handle_exception(err):
-                        raise
-                else:
-                    # only update the timers if the api call was successful
-                    self._schedule['updated'] = datetime.now()
-
-                _LOGGER.debug(
-                    "update(%s), self._schedule = %s",
-                    self._id,
-                    self._schedule
-                )
+            day_time, _ = self._switchpoint(next_switchpoint=True)
+            if day_time is not None:
+                delays.append((day_time - local_now()).total_seconds())
 
-        return True
+        for until in (self._status.until, self._loc_data['status'].until):
+            if until is not None:
+                delays.append(
+                    (parse_datetime(until) - utcnow()).total_seconds())
+
+        delays = [d for d in delays if d > 0]  # e.g. the override has expired
+        return min(delays) if delays else None
+
+    def _set_state_timer(self):
+        """Arrange for the state to be updated when it next changes.
+
+        The timer is (re)set only if that time has changed. There is no timer
+        unless the state is derived locally (else it changes only with a poll).
+        """
+        if self._status is None or self.hass is None or \
+                not self._use_local_setpoints():
+            return
+
+        delay = self._next_state_change()
+        if delay is not None:
+            delay = round(delay) + STATE_TIMER_MARGIN
+            due = monotonic() + delay
+
+            # the timer is already set for (about) the same time
+            if self._state_timer_unsub is not None and \
+                    abs(due - self._state_timer_due) < 2:
+                return
+
+        if self._state_timer_unsub is not None:
+            self._state_timer_unsub()
+            self._state_timer_unsub = None
+
+        if delay is not None:
+            _LOGGER.debug(
+                "_set_state_timer(%s): the state will change in %ss",
+                self._id,
+                delay
+            )
+            self._state_timer_unsub = async_call_later(
+                self.hass, delay, self._async_state_timer)
+            self._state_timer_due = due
+
+    @callback
+    def _async_state_timer(self, now):  # pylint: disable=unused-argument
+        """Update the state (locally, without an API call) as it changes."""
+        self._state_timer_unsub = None
+
+        self._memo_key = None  # e.g. the switchpoint has passed
+        self.async_schedule_update_ha_state(force_refresh=False)
+        self._set_state_timer()
@@ -0,0 +1,83 @@
+"""Support for Sensor devices of (EMEA/EU) Honeywell evohome systems.
+
+Specifically supports a sensor of the API request budget (the number of
+requests that can be made of the vendor's web servers, right now).
+
+For more details about this platform, please refer to the documentation at
+https://github.com/zxdavb/evohome/
+"""
+# pylint: disable=deprecated-method, unused-import; ZXDEL
+
+__version__ = '0.9.6'
+
+import logging
+
+from homeassistant.helpers.entity import Entity
+from custom_components.evohome_cc import (
+    DATA_EVOHOME, CONF_ATTRIBUTE_PROFILE, ATTRS_DEBUG,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+async def async_setup_platform(hass, hass_config, async_add_entities,
+                               discovery_info=None):
+    """Create the API request budget sensor."""
+    evo_data = hass.data[DATA_EVOHOME]
+
+    async_add_entities(
+        [EvoBudgetSensor(evo_data['client'], evo_data['params'])],
+        update_before_add=False
+    )
+
+
+class EvoBudgetSensor(Entity):
+    """The remaining API request budget, shared by all evohome entities."""
+
+    def __init__(self, client, params):
+        """Initialize the API request budget sensor."""
+        self._client = client
+        self._budget = client.budget
+        self._profile = params[CONF_ATTRIBUTE_PROFILE]
+
+        self._name = "evohome API budget"
+        self._icon = "mdi:speedometer"
+
+    @property
+    def name(self) -> str:
+        """Return the name to use in the frontend UI."""
+        return self._name
+
+    @property
+    def icon(self):
+        """Return the icon to use in the frontend UI."""
+        return self._icon
+
+    @property
+    def state(self):
+        """Return the number of requests that can be made right now."""
+        return self._budget.remaining
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of measurement of the budget."""
+        return 'requests'
+
+    @property
+    def device_state_attributes(self):
+        """Return the optional device state attributes.
+
+        The counters change with every poll (and the recorder would store
+        them every time), so they are included only by the debug profile.
+        """
+        data = {
+            'capacity': self._budget.capacity,
+            'reserved_for_writes': self._budget.reserve,
+            'refill_per_hour': round(self._budget.rate * 3600),
+            'backoff_remaining': round(self._budget.backoff_remaining),
+        }
+        if self._profile == ATTRS_DEBUG:
+            data['requests'] = self._budget.requests
+            data['deferred'] = self._budget.deferred
+            data.update(self._client.connection_stats)
+        return data
@@ -0,0 +1,224 @@
+"""Benchmarks for the hot paths of evohome_cc's entities.
+
+HA reads an entity's state, state_attributes, device_state_attributes and
+availability on every state write. This builds a Controller, its Zones and
+DHW (with heuristics, schedules and high_precision enabled) against the local
+stand-in, for 1, 12 and 100 zones, and measures:
+ - write: the CPU time (us) for HA to write the state of every entity (as
+   it does once a poll lands, i.e. with nothing memoized), and
+ - poll: the CPU time (ms) of a poll cycle (the controller's update(), and
+   then every child's update()), including the stand-in's share of it.
+
+Results are compared with a baseline saved (with --save) on the same machine,
+and the benchmark fails (exits 1) if any is worse than the baseline by more
+than the threshold, or if there is no baseline to compare with.
+
+Requires homeassistant (and so aiohttp). Run it from the tools folder:
+
+    python3 evohome_benchmark.py --save           # (re)create the baseline
+    python3 evohome_benchmark.py --threshold 1.25  # compare with it
+
+The stand-in listens on port 8089 (use --port if that is in use).
+"""
+# pylint: disable=protected-access, wrong-import-position; ZXDEL
+
+import argparse
+import asyncio
+from datetime import datetime
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import types
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TOOLS_DIR)
+
+# the repo is the custom_components folder, so make it importable as such
+sys.modules['custom_components'] = types.ModuleType('custom_components')
+sys.modules['custom_components'].__path__ = [REPO_DIR]
+
+from homeassistant.core import HomeAssistant                                    # noqa: E402
+from homeassistant.helpers.storage import Store                                 # noqa: E402
+
+from custom_components.evohome_cc import (                                      # noqa: E402
+    DOMAIN, DATA_EVOHOME, CONFIG_SCHEMA, CONF_API_HOST,
+    CONF_HIGH_PRECISION, CONF_USE_HEURISTICS, CONF_USE_SCHEDULES,
+    GWS, TCS, STORAGE_VERSION, STORAGE_KEY_SCHEDULES,
+    EvoBudget, EvoClient, ZoneConfig, location_data,
+)
+from custom_components.climate.evohome_cc import EvoController, EvoZone         # noqa: E402
+from custom_components.water_heater.evohome_cc import EvoDHW                    # noqa: E402
+
+from evohome_stand_in import Installation, StandIn                              # noqa: E402
+
+ZONE_COUNTS = [1, 12, 100]
+BASELINE_FILE = os.path.join(TOOLS_DIR, 'benchmark_baseline.json')
+THRESHOLD_DEFAULT = 1.25  # a regression is worse than the baseline by this
+
+HOST, PORT_DEFAULT = '127.0.0.1', 8089  # of the stand-in
+LOG_LEVEL_DEFAULT = 'INFO'  # as HA's, if it has no logger: config
+WRITES = 200  # the number of state writes (of every entity) to time
+POLLS = 50  # the number of poll cycles to time
+REPEATS = 5  # each is timed this many times, and the best is used (less noise)
+
+
+def build_entities(hass, installation, port):
+    """Create the entities of a location, as async_setup() would."""
+    params = CONFIG_SCHEMA({DOMAIN: {
+        'username': 'stand_in',
+        'password': 'stand_in',
+        CONF_HIGH_PRECISION: True,
+        CONF_USE_HEURISTICS: True,
+        CONF_USE_SCHEDULES: True,
+        CONF_API_HOST: 'http://{}:{}'.format(HOST, port),
+    }})[DOMAIN]
+
+    client = EvoClient(hass, 'stand_in', 'stand_in', params[CONF_API_HOST])
+    client.budget = EvoBudget(capacity=10 ** 9)  # don't defer any requests
+
+    evo_data = hass.data[DATA_EVOHOME] = {
+        'params': params,
+        'client': client,
+        'schedules': {},
+        'schedule_store': Store(hass, STORAGE_VERSION, STORAGE_KEY_SCHEDULES),
+    }
+    loc_data = location_data(installation.config)
+    evo_data['locations'] = [loc_data]
+
+    tcs_config = installation.config[GWS][0][TCS][0]
+    controller = EvoController(evo_data, loc_data, client, tcs_config)
+    children = [EvoZone(evo_data, loc_data, client, ZoneConfig(zone_config))
+                for zone_config in tcs_config['zones']]
+    children.append(EvoDHW(evo_data, loc_data, client, tcs_config['dhw']))
+
+    for idx, entity in enumerate([controller] + children):
+        entity.hass = hass
+        entity.entity_id = 'climate.evohome_{}'.format(idx)
+
+    return client, controller, children
+
+
+async def async_poll(controller, children):
+    """Run a (full) poll cycle."""
+    controller._timers['statusUpdated'] = datetime.min  # i.e. it has expired
+    controller._last_status_hash = None  # else the (same) status isn't parsed
+    await controller.async_update()
+    for child in children:
+        await child.async_update()
+
+
+def write_states(entities):
+    """Read what HA reads when it writes the state of each entity.
+
+    This is the first write after a poll lands (i.e. without any memoized
+    state), as HA writes the state of each entity once per poll.
+    """
+    entities[0]._loc_data['generation'] += 1  # as if a poll has landed
+    for entity in entities:
+        _ = entity.available
+        _ = entity.state
+        _ = entity.state_attributes
+        _ = entity.device_state_attributes
+
+
+async def async_benchmark(hass, zones, port):
+    """Return the write (us) and poll (ms) CPU times, for a number of zones."""
+    stand_in = StandIn([Installation(zones, offline=zones // 10)])
+    runner = await stand_in.async_start(HOST, port)
+
+    client, controller, children = build_entities(
+        hass, next(iter(stand_in.installations.values())), port)
+
+    try:
+        await async_poll(controller, children)  # also obtains the schedules
+
+        poll = write = float('inf')
+        for _ in range(REPEATS):
+            start = time.process_time()
+            for _ in range(POLLS):
+                await async_poll(controller, children)
+            poll = min(poll, (time.process_time() - start) / POLLS * 1e3)
+
+            start = time.process_time()
+            for _ in range(WRITES):
+                write_states([controller] + children)
+            write = min(write, (time.process_time() - start) / WRITES * 1e6)
+
+    finally:
+        await client.async_close()
+        await runner.cleanup()
+
+    return {'write_us': round(write, 1), 'poll_ms': round(poll, 2)}
+
+
+def compare(results, baseline, threshold):
+    """Return the list of results that are worse than the baseline."""
+    regressions = []
+    for zones, result in results.items():
+        for key, value in result.items():
+            base = baseline.get(zones, {}).get(key)
+            if base and value > base * threshold:
+                regressions.append(
+                    "{} zones, {}: {} (baseline: {})".format(
+                        zones, key, value, base))
+    return regressions
+
+
+def main():
+    """Run the benchmarks, and compare the results with the baseline."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--save', action='store_true',
+                        help="save the results as the (new) baseline")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD_DEFAULT,
+                        help="fail if a result is worse than this x baseline")
+    parser.add_argument('--zones', type=int, nargs='+', default=ZONE_COUNTS)
+    parser.add_argument('--port', type=int, default=PORT_DEFAULT,
+                        help="the port for the stand-in to listen on")
+    parser.add_argument('--log-level', default=LOG_LEVEL_DEFAULT,
+                        help="the log level (logging is part of the cost)")
+    args = parser.parse_args()
+
+    # the log records are formatted (as that is part of the cost), but then
+    # discarded, as the entities log every API call (at warning)
+    logging.basicConfig(
+        level=args.log_level.upper(), stream=open(os.devnull, 'w'))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant(loop)
+        hass.config.config_dir = config_dir
+
+        for zones in args.zones:
+            results[str(zones)] = loop.run_until_complete(
+                async_benchmark(hass, zones, args.port))
+            print("{:>4} zones: {}".format(zones, results[str(zones)]))
+
+    loop.close()
+
+    if args.save:
+        with open(BASELINE_FILE, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=4, sort_keys=True)
+        print("Saved as the baseline: {}".format(BASELINE_FILE))
+        return 0
+
+    if not os.path.exists(BASELINE_FILE):
+        print("There is no baseline to compare with (use: --save).")
+        return 1
+
+    with open(BASELINE_FILE) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print("REGRESSION: {}".format(regression))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
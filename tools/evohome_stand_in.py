@@ -0,0 +1,402 @@
+"""A local stand-in for the vendor's (v1 and v2) web APIs, for evohome_cc.
+
+It serves recorded (redacted) payloads from the fixtures folder, so that the
+component's setup(), the controller's update() and the write paths can be
+exercised (e.g. benchmarked) without the vendor's web servers. The recorded
+installation can be scaled up to any number of zones (some of them offline),
+and to any number of locations.
+
+Latency and errors (429, 503, and connection resets) can be injected.
+
+To point the component at the stand-in, use the api_host parameter:
+
+    evohome_cc:
+      username: stand_in
+      password: stand_in
+      api_host: http://127.0.0.1:8080
+
+Usage: python3 evohome_stand_in.py [--zones 12] [--offline 2] [--locations 1]
+           [--latency 0.2] [--error-rate 0.05] [--errors 429,503,reset]
+"""
+# pylint: disable=unused-argument; ZXDEL
+
+import argparse
+import asyncio
+from collections import Counter
+import copy
+import json
+import logging
+import os
+import random
+
+from aiohttp import web
+
+_LOGGER = logging.getLogger(__name__)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# as used by the component's client (which can't be imported without HA)
+API_AUTH_URL = '/Auth/OAuth/Token'
+API_V1_URL = '/WebAPI/api/'
+API_V2_URL = '/WebAPI/emea/api/v1/'
+
+ERRORS = ['429', '503', 'reset']
+
+GWS = 'gateways'
+TCS = 'temperatureControlSystems'
+
+ID_OFFSET = 100000  # ids of each scaled/extra location/zone are offset by this
+
+
+def load_fixture(name):
+    """Return a (recorded) payload from the fixtures folder."""
+    with open(os.path.join(FIXTURES, name)) as fixture:
+        return json.load(fixture)
+
+
+class Installation:
+    """The config, status and schedules of a single location.
+
+    The status is updated by the write endpoints, so that a subsequent poll
+    will reflect any changes (as it would with the vendor's servers).
+    """
+
+    def __init__(self, zones=None, offline=0, index=0):
+        """Load the recorded location, and scale it as required."""
+        self.config = load_fixture('installation_info.json')[0]
+        self.status = load_fixture('location_status.json')
+        self.location_v1 = load_fixture('locations_v1.json')[0]
+        self.schedules = {
+            'temperatureZone': load_fixture('schedule_zone.json'),
+            'domesticHotWater': load_fixture('schedule_dhw.json'),
+        }
+
+        if index:
+            self._offset_ids(index * ID_OFFSET * 10)
+        if zones is not None:
+            self._scale(zones)
+        if offline:
+            self._set_offline(offline)
+
+        # index the mutable state data, for the write endpoints
+        self.zones = {z['zoneId']: z for z in self.tcs_status['zones']}
+        self.devices_v1 = {str(d['deviceID']): d
+                           for d in self.location_v1['devices']}
+
+    @property
+    def location_id(self):
+        """Return the id of the location."""
+        return self.config['locationInfo']['locationId']
+
+    @property
+    def tcs_config(self):
+        """Return the config of the location's controller."""
+        return self.config[GWS][0][TCS][0]
+
+    @property
+    def tcs_status(self):
+        """Return the status of the location's controller."""
+        return self.status[GWS][0][TCS][0]
+
+    def _offset_ids(self, offset):
+        """Give this location (and its devices) ids that are unique."""
+        def _new_id(old_id):
+            return str(int(old_id) + offset)
+
+        info = self.config['locationInfo']
+        info['locationId'] = _new_id(info['locationId'])
+        info['name'] = "{} {}".format(info['name'], offset // ID_OFFSET // 10)
+        self.status['locationId'] = info['locationId']
+        self.location_v1['locationID'] = int(info['locationId'])
+        self.location_v1['name'] = info['name']
+
+        for config in (self.tcs_config, self.tcs_status):
+            config['systemId'] = _new_id(config['systemId'])
+            for zone in config['zones']:
+                zone['zoneId'] = _new_id(zone['zoneId'])
+            config['dhw']['dhwId'] = _new_id(config['dhw']['dhwId'])
+
+        for device in self.location_v1['devices']:
+            device['deviceID'] += offset
+
+    def _scale(self, zones):
+        """Replace the recorded zones with copies of an (available) one."""
+        templates = (
+            self.tcs_config['zones'][1],
+            self.tcs_status['zones'][1],
+            self.location_v1['devices'][-1],
+        )
+        base_id = int(templates[0]['zoneId'])
+
+        configs, statuses, devices = [], [], []
+        for idx in range(zones):
+            zone_id = str(base_id + ID_OFFSET + idx)
+            name = "Zone {:03d}".format(idx)
+
+            config, status, device = copy.deepcopy(templates)
+            config['zoneId'] = status['zoneId'] = zone_id
+            config['name'] = status['name'] = device['name'] = name
+            device['deviceID'] = int(zone_id)
+
+            # give each zone a slightly different temperature
+            temp = 18 + (idx % 8) * 0.25
+            status['temperatureStatus']['temperature'] = round(temp * 2) / 2
+            device['thermostat']['indoorTemperature'] = temp + 0.12
+
+            configs.append(config)
+            statuses.append(status)
+            devices.append(device)
+
+        self.tcs_config['zones'] = configs
+        self.tcs_status['zones'] = statuses
+        # as the vendor: the DHW first (if any), then the zones ordered by name
+        self.location_v1['devices'] = [
+            d for d in self.location_v1['devices']
+            if d['thermostatModelType'] == 'DOMESTIC_HOT_WATER'
+        ] + devices
+
+    def _set_offline(self, offline):
+        """Make the last few zones unavailable (e.g. flat batteries)."""
+        for status in self.tcs_status['zones'][-offline:]:
+            status['temperatureStatus'] = {'isAvailable': False}
+
+            device = next(d for d in self.location_v1['devices']
+                          if str(d['deviceID']) == status['zoneId'])
+            device['thermostat']['indoorTemperature'] = 128.0
+
+    def set_zone_setpoint(self, zone_id, data):
+        """Update the state of a zone, as if it had been written."""
+        setpoint = self.zones[zone_id]['setpointStatus']
+        setpoint['setpointMode'] = data['SetpointMode']
+        setpoint.pop('until', None)
+
+        if data['SetpointMode'] != 'FollowSchedule':
+            setpoint['targetHeatTemperature'] = data['HeatSetpointValue']
+            if data.get('TimeUntil'):
+                setpoint['until'] = data['TimeUntil']
+
+        values = self.devices_v1[zone_id]['thermostat']['changeableValues']
+        values['heatSetpoint']['value'] = setpoint['targetHeatTemperature']
+
+    def set_tcs_mode(self, data):
+        """Update the mode of the controller, as if it had been written."""
+        self.tcs_status['systemModeStatus'] = {
+            'mode': data['SystemMode'],
+            'isPermanent': data.get('Permanent', True),
+        }
+
+    def set_dhw_state(self, data):
+        """Update the state of the DHW, as if it had been written."""
+        state = self.tcs_status['dhw']['stateStatus']
+        state['mode'] = data['Mode']
+        if data.get('State'):
+            state['state'] = data['State']
+
+
+class StandIn:
+    """An aiohttp web app that stands in for the vendor's web APIs."""
+
+    def __init__(self, installations, latency=0, error_rate=0, errors=None):
+        """Initialize the stand-in (this does no I/O)."""
+        self.installations = {i.location_id: i for i in installations}
+        self.latency = latency  # seconds, added to every request
+        self.error_rate = error_rate  # the fraction of requests that fail
+        self.errors = errors or ERRORS
+
+        self.requests = Counter()  # by handler, e.g. for benchmarks
+
+    def make_app(self):
+        """Return the web app, with the vendor's endpoints."""
+        app = web.Application(middlewares=[self._middleware])
+
+        app.router.add_post(API_AUTH_URL, self.token)
+
+        app.router.add_get(API_V2_URL + 'userAccount', self.user_account)
+        app.router.add_get(
+            API_V2_URL + 'location/installationInfo', self.installation_info)
+        app.router.add_get(
+            API_V2_URL + 'location/{location_id}/status', self.location_status)
+        app.router.add_get(
+            API_V2_URL + '{zone_type}/{zone_id}/schedule', self.schedule)
+        app.router.add_put(
+            API_V2_URL + 'temperatureZone/{zone_id}/heatSetpoint',
+            self.zone_setpoint)
+        app.router.add_put(
+            API_V2_URL + 'temperatureControlSystem/{system_id}/mode',
+            self.tcs_mode)
+        app.router.add_put(
+            API_V2_URL + 'domesticHotWater/{dhw_id}/state', self.dhw_state)
+
+        app.router.add_post(API_V1_URL + 'Session', self.session_v1)
+        app.router.add_get(API_V1_URL + 'locations/', self.locations_v1)
+
+        return app
+
+    async def async_start(self, host='127.0.0.1', port=8080):
+        """Start serving (in the current event loop), and return the runner.
+
+        The component's api_host would then be: http://<host>:<port>.
+        """
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        """Count the requests, and inject any latency/errors."""
+        self.requests[handler.__name__] += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.error_rate and random.random() < self.error_rate:
+            error = random.choice(self.errors)
+            _LOGGER.info("Injecting error: %s (%s)", error, request.path)
+
+            if error == '429':
+                raise web.HTTPTooManyRequests()
+            if error == '503':
+                raise web.HTTPServiceUnavailable()
+            # otherwise, a connection reset: drop the connection, no response
+            request.transport.abort()
+            return web.Response()
+
+        return await handler(request)
+
+    @staticmethod
+    def _check_auth_v2(request):
+        if not request.headers.get('Authorization', '').startswith('bearer '):
+            raise web.HTTPUnauthorized()
+
+    @staticmethod
+    def _check_auth_v1(request):
+        if not request.headers.get('sessionId'):
+            raise web.HTTPUnauthorized()
+
+    def _installation(self, location_id):
+        try:
+            return self.installations[location_id]
+        except KeyError:
+            raise web.HTTPNotFound()
+
+    def _zone_installation(self, zone_id):
+        for installation in self.installations.values():
+            if zone_id in installation.zones:
+                return installation
+            if zone_id == installation.tcs_status.get('dhw', {}).get('dhwId'):
+                return installation
+        raise web.HTTPNotFound()
+
+    async def token(self, request):
+        """Return an access token (for either grant type)."""
+        data = await request.post()
+        if data.get('grant_type') not in ('password', 'refresh_token'):
+            raise web.HTTPBadRequest()
+
+        return web.json_response({
+            'access_token': 'stand_in_access_token',
+            'token_type': 'bearer',
+            'expires_in': 1800,
+            'refresh_token': 'stand_in_refresh_token',
+        })
+
+    async def user_account(self, request):
+        """Return the (v2) user account."""
+        self._check_auth_v2(request)
+        return web.json_response({'userId': '2263181', 'username': 'stand_in'})
+
+    async def installation_info(self, request):
+        """Return the config of all the locations."""
+        self._check_auth_v2(request)
+        return web.json_response(
+            [i.config for i in self.installations.values()])
+
+    async def location_status(self, request):
+        """Return the status of a location."""
+        self._check_auth_v2(request)
+        installation = self._installation(request.match_info['location_id'])
+        return web.json_response(installation.status)
+
+    async def schedule(self, request):
+        """Return the schedule of a zone/DHW (all zones share a schedule)."""
+        self._check_auth_v2(request)
+        installation = self._zone_installation(request.match_info['zone_id'])
+
+        try:
+            schedule = installation.schedules[request.match_info['zone_type']]
+        except KeyError:
+            raise web.HTTPNotFound()
+        return web.json_response(schedule)
+
+    async def zone_setpoint(self, request):
+        """Set (or cancel) the override of a zone."""
+        self._check_auth_v2(request)
+        zone_id = request.match_info['zone_id']
+        self._zone_installation(zone_id).set_zone_setpoint(
+            zone_id, await request.json())
+        return web.json_response({'id': '1'})
+
+    async def tcs_mode(self, request):
+        """Set the mode of a controller."""
+        self._check_auth_v2(request)
+        system_id = request.match_info['system_id']
+        for installation in self.installations.values():
+            if installation.tcs_status['systemId'] == system_id:
+                installation.set_tcs_mode(await request.json())
+                return web.json_response({'id': '1'})
+        raise web.HTTPNotFound()
+
+    async def dhw_state(self, request):
+        """Set the state of a DHW."""
+        self._check_auth_v2(request)
+        self._zone_installation(request.match_info['dhw_id']).set_dhw_state(
+            await request.json())
+        return web.json_response({'id': '1'})
+
+    async def session_v1(self, request):
+        """Return a (v1) session id."""
+        return web.json_response({
+            'sessionId': 'stand_in_session_id',
+            'userInfo': {'userID': 2263181},
+        })
+
+    async def locations_v1(self, request):
+        """Return all the locations (with their devices), via the v1 API."""
+        self._check_auth_v1(request)
+        return web.json_response(
+            [i.location_v1 for i in self.installations.values()])
+
+
+def main():
+    """Run the stand-in, until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--zones', type=int, default=None,
+                        help="zones per location (default: as recorded)")
+    parser.add_argument('--offline', type=int, default=0,
+                        help="zones per location that are unavailable")
+    parser.add_argument('--locations', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0,
+                        help="seconds, added to every request")
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help="the fraction of requests that fail (0-1)")
+    parser.add_argument('--errors', default=','.join(ERRORS),
+                        help="the errors to inject, from: 429,503,reset")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    stand_in = StandIn(
+        [Installation(args.zones, args.offline, idx)
+         for idx in range(args.locations)],
+        latency=args.latency,
+        error_rate=args.error_rate,
+        errors=args.errors.split(',')
+    )
+    web.run_app(stand_in.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,10 +10,10 @@ https://github.com/zxdavb/evohome/
 
 __version__ = '0.9.6'
 
-from datetime import datetime, timedelta
+from datetime import timedelta
 import logging
 
-import requests.exceptions
+import aiohttp
 
 # from homeassistant.components.climate import (
     # ClimateDevice
@@ -47,7 +47,8 @@ from custom_components.evohome_cc import (
     ZONE_STATE_TO_HA, HA_STATE_TO_ZONE, ZONE_OP_LIST,
 
     # EvoDevice,
-    EvoChildDevice,
+    EvoChildDevice, memoized, expected_dhw_state, format_until, local_now,
+    requires_status,
 )
 ATTR_UNTIL = 'until'
 
@@ -56,23 +57,24 @@ _LOGGER = logging.getLogger(__name__)
 
 async def async_setup_platform(hass, hass_config, async_add_entities,
                                discovery_info=None):
-    """Create the DHW controller."""
+    """Create the DHW controller(s), if any."""
     evo_data = hass.data[DATA_EVOHOME]
 
     client = evo_data['client']
-    loc_idx = evo_data['params'][CONF_LOCATION_IDX]
+    dhws = []
 
-    tcs_obj_ref = client.locations[loc_idx]._gateways[0]._control_systems[0]    # noqa E501; pylint: disable=protected-access
+    for loc_data in evo_data['locations']:
+        tcs_config = loc_data['config'][GWS][0][TCS][0]
+        if 'dhw' not in tcs_config:
+            continue
 
-    _LOGGER.info(
-        "setup(): Found DHW device, id: %s (%s)",
-        tcs_obj_ref.hotwater.zoneId,  # same has .dhwId
-        tcs_obj_ref.hotwater.zone_type
-    )
-
-    dhw = EvoDHW(evo_data, client, tcs_obj_ref.hotwater)
+        _LOGGER.info(
+            "setup(): Found DHW device, id: %s",
+            tcs_config['dhw']['dhwId']
+        )
+        dhws.append(EvoDHW(evo_data, loc_data, client, tcs_config['dhw']))
 
-    async_add_entities([dhw], update_before_add=False)
+    async_add_entities(dhws, update_before_add=False)
 
 
 class EvoDHW(EvoChildDevice, WaterHeaterDevice):
@@ -80,11 +82,9 @@ class EvoDHW(EvoChildDevice, WaterHeaterDevice):
 
     # pylint: disable=abstract-method
 
-    def __init__(self, evo_data, client, obj_ref):
+    def __init__(self, evo_data, loc_data, client, config):
         """Initialize the evohome DHW controller."""
-        super().__init__(evo_data, client, obj_ref)
-
-        self._config = evo_data['config'][GWS][0][TCS][0]['dhw']
+        super().__init__(evo_data, loc_data, client, config)
 
         self._operation_list = ZONE_OP_LIST
 
@@ -105,7 +105,7 @@ class EvoDHW(EvoChildDevice, WaterHeaterDevice):
         _LOGGER.debug("target_temperature(%s) = %s", self._id, temp)
         return temp
 
-    def _set_dhw_state(self, state=None, mode=None, until=None):
+    async def _async_set_dhw_state(self, state=None, mode=None, until=None):
         """Set the new state of a DHW controller.
 
         Turn the DHW on/off for an hour, until next setpoint, or indefinitely.
@@ -114,7 +114,7 @@ class EvoDHW(EvoChildDevice, WaterHeaterDevice):
         Keyword arguments can be:
           - state  = "On" | "Off" (no default)
           - mode  = "TemporaryOverride" (default) | "PermanentOverride"
-          - until.strftime('%Y-%m-%dT%H:%M:%SZ') is:
+          - until (a datetime, sent as UTC, see: format_until()) is:
             - +1h for TemporaryOverride if not using schedules
             - next setpoint for TemporaryOverride if using schedules
             - ignored for PermanentOverride
@@ -128,7 +128,7 @@ class EvoDHW(EvoChildDevice, WaterHeaterDevice):
         )
 
         if state is None:
-            state = self._status['stateStatus']['state']
+            state = self._status.state
         if mode is None:
             mode = EVO_TEMPOVER
 
@@ -137,34 +137,43 @@ class EvoDHW(EvoChildDevice, WaterHeaterDevice):
         else:
             if until is None:
                 if self._params[CONF_USE_SCHEDULES]:
-                    until = self._next_switchpoint_time
+                    until = self._next_switchpoint_time()
                 else:
-                    until = datetime.now() + timedelta(hours=1)
+                    until = local_now() + timedelta(hours=1)
 
         if until is not None:
-            until = until.strftime('%Y-%m-%dT%H:%M:%SZ')
+            until = format_until(until)
 
         data = {'State': state, 'Mode': mode, 'UntilTime': until}
 
+        # the new state is pending until a poll confirms it
+        if state:  # else (FollowSchedule) it will be that of the schedule
+            self._issue_command(state=state, mode=mode, until=until)
+        else:
+            self._issue_command(mode=mode, until=until)
+        self._set_state_timer()  # e.g. for the expiry of the (new) until
+        self.async_schedule_update_ha_state(force_refresh=False)
+
         _LOGGER.warn(
-            "_set_dhw_state(%s): API call [1 request(s)]: dhw._set_dhw(%s)...",
+            "_set_dhw_state(%s): API call [1 request(s)]: "
+            "client.set_dhw_state(%s)...",
             self._id,
             data
         )
 
         try:
-            self._obj._set_dhw(data)                                            # noqa: E501; pylint: disable=protected-access
+            await self._client.async_set_dhw_state(self._id, data)
 
-        except requests.exceptions.HTTPError as err:
+        except aiohttp.ClientError as err:
+            self._command_failed()
             if not self._handle_exception(err):
                 raise
+            return
 
-        if self._params[CONF_USE_HEURISTICS]:
-            self._status['stateStatus']['state'] = state
-            self._status['stateStatus']['mode'] = mode
-            self.async_schedule_update_ha_state(force_refresh=False)
+        self._notify_write()
 
     @property
+    @memoized
     def state(self):
         """Return the state of a DHW controller.
 
@@ -173,13 +182,19 @@ class EvoDHW(EvoChildDevice, WaterHeaterDevice):
           - Off, current temp is ignored
           - Away, Off regardless of scheduled state
         """
-        evo_data = self.hass.data[DATA_EVOHOME]
-
-        tcs_op_mode = evo_data['status']['systemModeStatus']['mode']
-        dhw_op_mode = self._status['stateStatus']['mode']
+        tcs_op_mode = self._tcs_op_mode()
+        dhw_op_mode = self.current_operation
 
         # Determine the reported state
-        dhw_state = self._status['stateStatus']['state']
+        dhw_state = self._status.state
+
+        # Optionally, use the schedule to determine the state between polls
+        if self._use_local_setpoints():
+            expected = expected_dhw_state(
+                tcs_op_mode, dhw_op_mode, self._status,
+                self._schedule['timeline'])
+            if expected is not None:
+                dhw_state = expected
 
         if dhw_state == DHW_STATES[STATE_ON]:
             state = STATE_ON
@@ -192,8 +207,10 @@ class EvoDHW(EvoChildDevice, WaterHeaterDevice):
                 state = EVO_AWAY  # a special form of 'Off'
 
         # Perform a sanity check & warn if it fails
+        is_transition = self._is_transition('state', state)
+
         if state == EVO_AWAY:
-            if dhw_state != DHW_STATES[STATE_OFF]:
+            if dhw_state != DHW_STATES[STATE_OFF] and is_transition:
                 _LOGGER.warning(
                     "state(%s) = %s, via inheritance (via api = %s)",
                     self._id,
@@ -219,7 +236,8 @@ class EvoDHW(EvoChildDevice, WaterHeaterDevice):
         _LOGGER.debug("is_on(%s) = %s", self._id, is_on)
         return is_on
 
-    def turn_on(self):
+    @requires_status
+    async def async_turn_on(self):
         """Turn DHW on for an hour, until next setpoint, or indefinitely."""
         mode = EVO_TEMPOVER
         until = None
@@ -231,9 +249,10 @@ class EvoDHW(EvoChildDevice, WaterHeaterDevice):
             until
         )
 
-        self._set_dhw_state(DHW_STATES[STATE_ON], mode, until)
+        await self._async_set_dhw_state(DHW_STATES[STATE_ON], mode, until)
 
-    def turn_off(self):
+    @requires_status
+    async def async_turn_off(self):
         """Turn DHW off for an hour, until next setpoint, or indefinitely."""
         mode = EVO_TEMPOVER
         until = None
@@ -245,9 +264,10 @@ class EvoDHW(EvoChildDevice, WaterHeaterDevice):
             until
         )
 
-        self._set_dhw_state(DHW_STATES[STATE_OFF], mode, until)
+        await self._async_set_dhw_state(DHW_STATES[STATE_OFF], mode, until)
 
-    def set_operation_mode(self, operation_mode):
+    @requires_status
+    async def async_set_operation_mode(self, operation_mode):
         """Set new operation mode for a DHW controller."""
         _LOGGER.debug(
             "set_operation_mode(%s, operation_mode=%s)",
@@ -259,19 +279,17 @@ class EvoDHW(EvoChildDevice, WaterHeaterDevice):
         if operation_mode == EVO_FOLLOW:
             state = ''
         else:
-            state = self._status['stateStatus']['state']
+            state = self._status.state
 
 # PermanentOverride - override target temp indefinitely
 # TemporaryOverride - override target temp, for a period of time
         if operation_mode == EVO_TEMPOVER:
             if self._params[CONF_USE_SCHEDULES]:
-                until = self._next_switchpoint_time
+                until = self._next_switchpoint_time()
             else:
-                until = datetime.now() + timedelta(hours=1)
-
-            until = until.strftime('%Y-%m-%dT%H:%M:%SZ')
+                until = local_now() + timedelta(hours=1)
 
         else:
             until = None
 
-        self._set_dhw_state(state, operation_mode, until)
+        await self._async_set_dhw_state(state, operation_mode, until)